@@ -0,0 +1,363 @@
+"""
+Bulk directory ingestion into a persistent VectorDatabase.
+
+Three stages connected by bounded queues:
+
+1. read  - files are read and parsed (PDF text extraction included) on a
+           process pool, with a bounded number of files in flight;
+2. split - documents are chunked with CharacterTextSplitter as they arrive;
+3. embed - chunks are embedded in batches, and each batch is written to the
+           index as its own segment file.
+
+The index is never held in memory. Segments are append-only, and each one
+lists the sources (files) whose earlier chunks it replaces, so a modified
+or deleted file is dropped without rewriting earlier segments;
+VectorDatabase.load replays them in order. An append-only checkpoint log
+keyed by file path and mtime lets re-runs skip unchanged files.
+
+Usage:
+    python -m aimakerspace.ingest path/to/docs --index path/to/index [--compact]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from aimakerspace.openai_utils.embedding import EmbeddingModel
+from aimakerspace.text_utils import (
+    CharacterTextSplitter,
+    iter_supported_files,
+    read_document,
+)
+from aimakerspace.vectordatabase import (
+    INDEX_FILE,
+    SEGMENTS_DIR,
+    replay_index,
+    write_index_file,
+)
+
+_DONE = object()
+
+
+class IngestCheckpoint:
+    """
+    Tracks the mtime of every file whose chunks are in the saved index.
+
+    Updates are appended to a JSON-lines log, one line per file, and the
+    log is compacted once when it is opened.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: Dict[str, float] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line torn by a crash; everything before it holds
+                        continue
+                    if record.get("deleted"):
+                        self.files.pop(record["path"], None)
+                    else:
+                        self.files[record["path"]] = record["mtime"]
+
+        with open(path + ".tmp", "w", encoding="utf-8") as f:
+            for file_path, mtime in self.files.items():
+                f.write(json.dumps({"path": file_path, "mtime": mtime}) + "\n")
+        os.replace(path + ".tmp", path)
+        self._log = open(path, "a", encoding="utf-8")
+
+    def is_current(self, file_path: str, mtime: float) -> bool:
+        return self.files.get(file_path) == mtime
+
+    def mark(self, file_path: str, mtime: float) -> None:
+        self.files[file_path] = mtime
+        self._append({"path": file_path, "mtime": mtime})
+
+    def forget(self, file_path: str) -> None:
+        self.files.pop(file_path, None)
+        self._append({"path": file_path, "deleted": True})
+
+    def _append(self, record: dict) -> None:
+        self._log.write(json.dumps(record) + "\n")
+        self._log.flush()
+
+    def close(self) -> None:
+        self._log.close()
+
+
+class _Batch:
+    """Chunks for one segment, plus the files it completes or removes."""
+
+    def __init__(self):
+        self.items: List[Tuple[str, str]] = []
+        self.deleted_sources: List[str] = []
+        self.empty_files: List[Tuple[str, float]] = []
+        self.removed_files: List[str] = []
+
+    def __bool__(self) -> bool:
+        return bool(self.items or self.deleted_sources)
+
+
+def _read_file(file_path: str) -> Tuple[str, Optional[str], Optional[str]]:
+    # Runs in a worker process; errors are returned rather than raised so
+    # one unreadable file does not abort the whole run.
+    try:
+        return file_path, read_document(file_path), None
+    except Exception as e:
+        return file_path, None, str(e)
+
+
+class IngestionPipeline:
+    def __init__(
+        self,
+        root: str,
+        index_path: str,
+        embedding_model: EmbeddingModel = None,
+        workers: int = None,
+        chunk_size: int = 1000,
+        chunk_overlap: int = 200,
+        batch_size: int = 256,
+        embed_concurrency: int = 4,
+    ):
+        self.root = os.path.abspath(root)
+        self.index_path = index_path
+        self.segments_path = os.path.join(index_path, SEGMENTS_DIR)
+        self.embedding_model = embedding_model
+        self.workers = workers or os.cpu_count() or 1
+        self.splitter = CharacterTextSplitter(chunk_size, chunk_overlap)
+        self.batch_size = batch_size
+        self.embed_concurrency = embed_concurrency
+        self.stats = {"skipped": 0, "failed": 0, "files": 0, "chunks": 0, "removed": 0}
+        self.errors = []
+
+    def _source(self, file_path: str) -> str:
+        return os.path.relpath(file_path, self.root)
+
+    async def _read_stage(self, pool: ProcessPoolExecutor, documents: asyncio.Queue):
+        # Futures are queued in submission order; the bounded queue caps the
+        # number of files being read (and held in memory) at any time.
+        loop = asyncio.get_running_loop()
+        seen = set()
+        for file_path in iter_supported_files(self.root):
+            try:
+                mtime = os.path.getmtime(file_path)
+            except OSError as e:
+                # Removed or unreadable since the walk listed it
+                self.stats["failed"] += 1
+                print(f"Skipping {file_path}: {e}")
+                continue
+            seen.add(file_path)
+            if self.checkpoint.is_current(file_path, mtime):
+                self.stats["skipped"] += 1
+                continue
+            future = loop.run_in_executor(pool, _read_file, file_path)
+            await documents.put((mtime, future))
+
+        # Files indexed by an earlier run that are no longer in the tree
+        for file_path in [p for p in self.checkpoint.files if p not in seen]:
+            await documents.put((None, file_path))
+        await documents.put(_DONE)
+
+    async def _split_stage(self, documents: asyncio.Queue, chunks: asyncio.Queue):
+        while (item := await documents.get()) is not _DONE:
+            mtime, future = item
+            if mtime is None:
+                await chunks.put((future, None, None))
+                continue
+            file_path, text, error = await future
+            if error is not None:
+                self.stats["failed"] += 1
+                print(f"Skipping {file_path}: {error}")
+                continue
+
+            prefix = f"[{self._source(file_path)}] "
+            keys = [prefix + chunk for chunk in self.splitter.split(text)]
+            await chunks.put((file_path, mtime, keys))
+        await chunks.put(_DONE)
+
+    async def _embed_batch(self, segment: int, batch: _Batch, pending: Dict[str, list], semaphore):
+        try:
+            keys = [key for _, key in batch.items]
+            if keys:
+                embeddings = await self.embedding_model.async_get_embeddings(keys)
+                matrix = np.array(embeddings, dtype=np.float32)
+            else:
+                matrix = np.zeros((0, 0), dtype=np.float32)
+            write_index_file(
+                os.path.join(self.segments_path, f"{segment:08d}.npz"),
+                keys,
+                matrix,
+                batch.deleted_sources,
+                sources=[self._source(file_path) for file_path, _ in batch.items],
+            )
+
+            # Checkpoint only once the segment is on disk
+            for file_path, _ in batch.items:
+                pending[file_path][1] -= 1
+                if pending[file_path][1] == 0:
+                    self._file_done(file_path, pending.pop(file_path)[0])
+            for file_path, mtime in batch.empty_files:
+                self._file_done(file_path, mtime)
+            for file_path in batch.removed_files:
+                self.checkpoint.forget(file_path)
+                self.stats["removed"] += 1
+        except Exception as e:
+            # Files in a failed batch are never checkpointed, so a re-run
+            # picks them up again and replaces any chunks that did land
+            self.errors.append(e)
+        finally:
+            semaphore.release()
+
+    def _file_done(self, file_path: str, mtime: float) -> None:
+        self.checkpoint.mark(file_path, mtime)
+        self.stats["files"] += 1
+
+    async def _embed_stage(self, chunks: asyncio.Queue):
+        semaphore = asyncio.Semaphore(self.embed_concurrency)
+        pending: Dict[str, list] = {}
+        tasks = set()
+        batch = _Batch()
+
+        async def flush():
+            # Segment numbers follow batch order, so a file's deletion always
+            # replays before its new chunks even if batches finish out of order
+            nonlocal batch
+            await semaphore.acquire()
+            if self.errors:
+                semaphore.release()
+                raise self.errors[0]
+            task = asyncio.create_task(
+                self._embed_batch(self.next_segment, batch, pending, semaphore)
+            )
+            self.next_segment += 1
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            batch = _Batch()
+
+        while (item := await chunks.get()) is not _DONE:
+            file_path, mtime, keys = item
+            # Drop chunks from any previous version of the file (a no-op for
+            # files that were never indexed)
+            batch.deleted_sources.append(self._source(file_path))
+            if keys is None:
+                batch.removed_files.append(file_path)
+                continue
+            if not keys:
+                batch.empty_files.append((file_path, mtime))
+                continue
+            pending[file_path] = [mtime, len(keys)]
+            self.stats["chunks"] += len(keys)
+            for key in keys:
+                batch.items.append((file_path, key))
+                if len(batch.items) >= self.batch_size:
+                    await flush()
+        if batch:
+            await flush()
+        await asyncio.gather(*tasks)
+        if self.errors:
+            raise self.errors[0]
+
+    def compact(self) -> None:
+        """
+        Folds all segments into a single index file.
+
+        This loads the whole index into memory, so it is opt-in. If it is
+        interrupted before the segments are moved aside, they are all
+        replayed over the new index file on the next load, which gives the
+        same result; once moved aside, they are never replayed.
+        """
+        vectors, sources = replay_index(self.index_path)
+        keys = list(vectors)
+        matrix = (
+            np.stack([np.asarray(vectors[key], dtype=np.float32) for key in keys])
+            if keys
+            else np.zeros((0, 0), dtype=np.float32)
+        )
+        write_index_file(
+            os.path.join(self.index_path, INDEX_FILE),
+            keys,
+            matrix,
+            sources=[sources[key] for key in keys],
+        )
+
+        # One rename retires every segment at once; deleting them one by one
+        # could leave an older segment to resurrect stale chunks
+        retired_path = self.segments_path + ".compacted"
+        shutil.rmtree(retired_path, ignore_errors=True)
+        os.replace(self.segments_path, retired_path)
+        shutil.rmtree(retired_path)
+
+    async def arun(self) -> Dict[str, int]:
+        self.embedding_model = self.embedding_model or EmbeddingModel()
+        os.makedirs(self.segments_path, exist_ok=True)
+        existing = [name for name in os.listdir(self.segments_path) if name.endswith(".npz")]
+        self.next_segment = max((int(name[:-4]) for name in existing), default=-1) + 1
+        self.checkpoint = IngestCheckpoint(os.path.join(self.index_path, "checkpoint.jsonl"))
+
+        documents = asyncio.Queue(maxsize=self.workers * 2)
+        chunks = asyncio.Queue(maxsize=self.workers * 2)
+        try:
+            with ProcessPoolExecutor(self.workers) as pool:
+                await asyncio.gather(
+                    self._read_stage(pool, documents),
+                    self._split_stage(documents, chunks),
+                    self._embed_stage(chunks),
+                )
+        finally:
+            self.checkpoint.close()
+        return self.stats
+
+    def run(self) -> Dict[str, int]:
+        return asyncio.run(self.arun())
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Index a directory of documents into a persistent VectorDatabase."
+    )
+    parser.add_argument("root", help="Directory to ingest")
+    parser.add_argument("--index", required=True, help="Directory to store the index in")
+    parser.add_argument("--workers", type=int, default=None, help="Reader processes (default: all cores)")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=200)
+    parser.add_argument("--batch-size", type=int, default=256, help="Chunks per embedding request")
+    parser.add_argument("--embed-concurrency", type=int, default=4, help="Embedding batches in flight")
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="Fold all segments into one index file afterwards (loads the whole index into memory)",
+    )
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    pipeline = IngestionPipeline(
+        args.root,
+        args.index,
+        workers=args.workers,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        batch_size=args.batch_size,
+        embed_concurrency=args.embed_concurrency,
+    )
+    stats = pipeline.run()
+    if args.compact:
+        pipeline.compact()
+    print(
+        f"Indexed {stats['files']} files ({stats['chunks']} chunks), "
+        f"skipped {stats['skipped']} unchanged, removed {stats['removed']} deleted, "
+        f"{stats['failed']} failed in {time.perf_counter() - started:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
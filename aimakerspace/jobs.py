@@ -0,0 +1,197 @@
+import asyncio
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class JobQueueFull(Exception):
+    """Raised when a job is submitted while the pending queue is at capacity."""
+
+
+class Job:
+    def __init__(self, job_id: str, kind: str, on_change: Callable[["Job"], None] = None):
+        self.id = job_id
+        self.kind = kind
+        self.status = "queued"
+        self.progress: Dict[str, Any] = {}
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self._on_change = on_change or (lambda job: None)
+
+    def update(self, **progress) -> None:
+        """Records progress counters reported by the running job."""
+        self.progress.update(progress)
+        self._on_change(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "Job":
+        job = cls(data["job_id"], data["kind"])
+        for field in ("status", "progress", "result", "error", "created_at", "started_at", "finished_at"):
+            setattr(job, field, data[field])
+        return job
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": dict(self.progress),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobQueue:
+    """
+    In-process background job queue served by a bounded pool of workers.
+
+    Throughput is governed by `workers`; `max_pending` bounds how many jobs
+    may wait, and finished jobs are kept so their status can still be
+    polled after they complete: at most `keep_finished` of them (oldest
+    evicted first), each for at most `finished_ttl` seconds.
+
+    With `state_dir`, every state change is also written to a JSON file per
+    job there, so any process sharing the directory can poll a job; results
+    of finished jobs are then kept on disk only.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 100, keep_finished: int = 1000,
+                 state_dir: str = None, finished_ttl: float = 3600):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.keep_finished = keep_finished
+        self.finished_ttl = finished_ttl
+        self.state_dir = state_dir
+        if state_dir is not None:
+            os.makedirs(state_dir, exist_ok=True)
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker_tasks = []
+
+    def _ensure_workers(self) -> None:
+        # Workers are started on first submit, inside the running event loop
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_pending)
+            self._worker_tasks = [
+                asyncio.create_task(self._worker()) for _ in range(self.workers)
+            ]
+
+    def submit(self, kind: str, func: Callable[..., Awaitable[Any]], *args) -> Job:
+        """
+        Enqueues `func(job, *args)`; its return value becomes the job result.
+
+        :raises JobQueueFull: if max_pending jobs are already waiting
+        """
+        self._ensure_workers()
+        job = Job(uuid.uuid4().hex, kind, self.save)
+        try:
+            self._queue.put_nowait((job, func, args))
+        except asyncio.QueueFull:
+            raise JobQueueFull(f"Too many pending jobs (max {self.max_pending})")
+        self._jobs[job.id] = job
+        self.save(job)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        Looks a job up in state_dir first, so jobs run by other processes are found.
+
+        Jobs that finished more than `finished_ttl` seconds ago are not
+        returned, even if they have not been evicted yet.
+        """
+        job = None
+        if self.state_dir is not None and job_id.isalnum():
+            try:
+                with open(self._state_path(job_id), encoding="utf-8") as f:
+                    job = Job.from_dict(json.load(f))
+            except (OSError, ValueError):
+                pass
+        job = job or self._jobs.get(job_id)
+        if job is not None and job.finished_at is not None:
+            if job.finished_at < time.time() - self.finished_ttl:
+                return None
+        return job
+
+    def save(self, job: Job) -> None:
+        """Publishes the job's current state to state_dir, if there is one."""
+        if self.state_dir is None:
+            return
+        path = self._state_path(job.id)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job.to_dict(), f)
+        os.replace(tmp_path, path)
+
+    def _state_path(self, job_id: str) -> str:
+        return os.path.join(self.state_dir, f"{job_id}.json")
+
+    def stats(self) -> Dict[str, int]:
+        counts = {"queued": 0, "running": 0, "completed": 0, "failed": 0}
+        for job in self._jobs.values():
+            counts[job.status] += 1
+        return {"workers": self.workers, **counts}
+
+    async def _worker(self) -> None:
+        while True:
+            job, func, args = await self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            self.save(job)
+            try:
+                job.result = await func(job, *args)
+                job.status = "completed"
+            except Exception as e:
+                job.error = str(e)
+                job.status = "failed"
+            finally:
+                job.finished_at = time.time()
+                self.save(job)
+                if self.state_dir is not None:
+                    # The state file holds the result now
+                    job.result = None
+                self._queue.task_done()
+                self._evict_finished()
+
+    def _evict_finished(self) -> None:
+        expired = time.time() - self.finished_ttl
+        finished = [j for j in self._jobs.values() if j.finished_at is not None]
+        excess = max(0, len(finished) - self.keep_finished)
+        for i, job in enumerate(finished):
+            if i < excess or job.finished_at < expired:
+                del self._jobs[job.id]
+                self._remove_state(job.id)
+
+        if self.state_dir is not None:
+            # Jobs finished by other processes sharing the directory (or by
+            # an earlier run); a state file is last written when its job
+            # finishes, so only files older than the TTL need a look
+            for name in os.listdir(self.state_dir):
+                job_id, ext = os.path.splitext(name)
+                if ext != ".json" or job_id in self._jobs:
+                    continue
+                try:
+                    if os.path.getmtime(self._state_path(job_id)) >= expired:
+                        continue
+                    with open(self._state_path(job_id), encoding="utf-8") as f:
+                        finished_at = json.load(f)["finished_at"]
+                except (OSError, ValueError, KeyError):
+                    continue
+                if finished_at is not None and finished_at < expired:
+                    self._remove_state(job_id)
+
+    def _remove_state(self, job_id: str) -> None:
+        if self.state_dir is None:
+            return
+        try:
+            os.remove(self._state_path(job_id))
+        except FileNotFoundError:
+            pass
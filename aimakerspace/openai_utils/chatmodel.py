@@ -1,45 +1,270 @@
 from openai import OpenAI, AsyncOpenAI
 from dotenv import load_dotenv
+import asyncio
 import os
+from contextlib import aclosing
+import time
+from typing import AsyncIterator, List, Optional
+
+from aimakerspace.openai_utils.scheduler import (
+    BULK,
+    INTERACTIVE,
+    UpstreamScheduler,
+    backoff_delay,
+    estimate_tokens,
+    get_scheduler,
+    is_retryable,
+)
 
 load_dotenv()
 
 
+def _estimate_request_tokens(messages, kwargs) -> int:
+    prompt_tokens = sum(estimate_tokens(str(m.get("content", ""))) for m in messages)
+    return prompt_tokens + (kwargs.get("max_tokens") or kwargs.get("max_completion_tokens") or 0)
+
+
+class _RetryStream(Exception):
+    """Internal signal that opening a stream failed with a retryable error."""
+
+    def __init__(self, error: Exception):
+        super().__init__(str(error))
+        self.status_code = getattr(error, "status_code", None)
+        self.response = getattr(error, "response", None)
+
+
+class CompletionResult:
+    """
+    The outcome of one completion in a batch, with timing and token usage.
+
+    `latency` runs from acquiring a concurrency slot to the final outcome,
+    so it covers scheduler waits, retries and backoff; `queue_wait` is the
+    time spent waiting for that concurrency slot.
+    """
+
+    def __init__(self, index: int, content: Optional[str] = None, response=None,
+                 latency: float = 0.0, attempts: int = 0, error: Exception = None,
+                 queue_wait: float = 0.0):
+        self.index = index
+        self.content = content
+        self.response = response
+        self.latency = latency
+        self.queue_wait = queue_wait
+        self.attempts = attempts
+        self.error = error
+        usage = getattr(response, "usage", None)
+        self.usage = {
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0),
+            "completion_tokens": getattr(usage, "completion_tokens", 0),
+            "total_tokens": getattr(usage, "total_tokens", 0),
+        }
+
+    def __repr__(self):
+        status = f"error={self.error!r}" if self.error else f"content={self.content!r:.40}"
+        return f"CompletionResult(index={self.index}, latency={self.latency:.2f}s, {status})"
+
+
 class ChatOpenAI:
-    def __init__(self, model_name: str = "gpt-4o-mini"):
+    def __init__(
+        self,
+        model_name: str = "gpt-4o-mini",
+        priority: int = INTERACTIVE,
+        scheduler: UpstreamScheduler = None,
+        max_retries: int = 2,
+    ):
         self.model_name = model_name
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
         if self.openai_api_key is None:
             raise ValueError("OPENAI_API_KEY is not set")
+        self.priority = priority
+        self.scheduler = scheduler or get_scheduler()
+        # Retries happen here rather than in the SDK, so that every attempt
+        # goes back through the scheduler and each 429 reaches its AIMD logic
+        self.max_retries = max_retries
 
     def run(self, messages, text_only: bool = True, **kwargs):
         if not isinstance(messages, list):
             raise ValueError("messages must be a list")
 
-        client = OpenAI()
-        response = client.chat.completions.create(
-            model=self.model_name, messages=messages, **kwargs
-        )
+        client = OpenAI(max_retries=0)
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with self.scheduler.slot(
+                    self.priority, _estimate_request_tokens(messages, kwargs), self.model_name
+                ):
+                    raw_response = client.chat.completions.with_raw_response.create(
+                        model=self.model_name, messages=messages, **kwargs
+                    )
+                break
+            except Exception as e:
+                if attempt > self.max_retries or not is_retryable(e):
+                    raise
+                time.sleep(backoff_delay(attempt))
+        self.scheduler.update_from_headers(raw_response.headers, self.model_name)
+        response = raw_response.parse()
 
         if text_only:
             return response.choices[0].message.content
 
         return response
-    
+
     async def astream(self, messages, **kwargs):
         if not isinstance(messages, list):
             raise ValueError("messages must be a list")
-        
-        client = AsyncOpenAI()
-
-        stream = await client.chat.completions.create(
-            model=self.model_name,
-            messages=messages,
-            stream=True,
-            **kwargs
-        )
 
-        async for chunk in stream:
-            content = chunk.choices[0].delta.content
-            if content is not None:
-                yield content
+        client = AsyncOpenAI(max_retries=0)
+
+        # Only opening the stream is retried; once content has been yielded
+        # a failure is passed to the caller.
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                # The slot is held for the whole stream, since the upstream
+                # connection stays busy until the last chunk arrives.
+                async with self.scheduler.aslot(
+                    self.priority, _estimate_request_tokens(messages, kwargs), self.model_name
+                ):
+                    try:
+                        raw_response = await client.chat.completions.with_raw_response.create(
+                            model=self.model_name,
+                            messages=messages,
+                            stream=True,
+                            **kwargs
+                        )
+                    except Exception as e:
+                        if attempt > self.max_retries or not is_retryable(e):
+                            raise
+                        # Leave the slot (recording the failure) before backing off
+                        raise _RetryStream(e)
+                    self.scheduler.update_from_headers(raw_response.headers, self.model_name)
+                    stream = raw_response.parse()
+
+                    async for chunk in stream:
+                        if not chunk.choices:
+                            continue
+                        content = chunk.choices[0].delta.content
+                        if content is not None:
+                            yield content
+                return
+            except _RetryStream:
+                await asyncio.sleep(backoff_delay(attempt))
+
+    async def _acomplete(self, client, index, messages, semaphore, priority,
+                         max_retries, base_delay, **kwargs) -> CompletionResult:
+        queued = time.perf_counter()
+        attempt = 0
+        async with semaphore:
+            started = time.perf_counter()
+            queue_wait = started - queued
+            while True:
+                attempt += 1
+                try:
+                    async with self.scheduler.aslot(
+                        priority, _estimate_request_tokens(messages, kwargs), self.model_name
+                    ):
+                        raw_response = await client.chat.completions.with_raw_response.create(
+                            model=self.model_name, messages=messages, **kwargs
+                        )
+                    self.scheduler.update_from_headers(raw_response.headers, self.model_name)
+                    response = raw_response.parse()
+                    return CompletionResult(
+                        index,
+                        content=response.choices[0].message.content,
+                        response=response,
+                        latency=time.perf_counter() - started,
+                        attempts=attempt,
+                        queue_wait=queue_wait,
+                    )
+                except Exception as e:
+                    if attempt > max_retries or not is_retryable(e):
+                        return CompletionResult(
+                            index, latency=time.perf_counter() - started,
+                            attempts=attempt, error=e, queue_wait=queue_wait,
+                        )
+                    await asyncio.sleep(backoff_delay(attempt, base_delay))
+
+    async def aiter_many(
+        self,
+        list_of_messages: List[list],
+        concurrency: int = 8,
+        max_retries: int = None,
+        base_delay: float = 1.0,
+        priority: int = BULK,
+        **kwargs,
+    ) -> AsyncIterator[CompletionResult]:
+        """
+        Runs many completions concurrently, yielding results as they complete.
+
+        Each result carries its `index` in `list_of_messages`, its latency
+        (including retries), the time it queued behind `concurrency`, token
+        usage, and `error` if it failed for good.
+
+        :param list_of_messages: One messages list per completion
+        :param concurrency: Maximum completions in flight at once
+        :param max_retries: Retries for rate limits, timeouts and 5xx errors
+            (default: this model's max_retries)
+        :param base_delay: Initial backoff in seconds, doubled on each retry
+        :param priority: Scheduler priority; batch work defaults to BULK
+        """
+        for messages in list_of_messages:
+            if not isinstance(messages, list):
+                raise ValueError("messages must be a list")
+        if max_retries is None:
+            max_retries = self.max_retries
+
+        # One client for the whole batch; retries are handled here, not by
+        # the client, so backoff and scheduler accounting stay consistent
+        client = AsyncOpenAI(max_retries=0)
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = [
+            asyncio.create_task(self._acomplete(
+                client, index, messages, semaphore, priority,
+                max_retries, base_delay, **kwargs
+            ))
+            for index, messages in enumerate(list_of_messages)
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await client.close()
+
+    async def arun_many(self, list_of_messages: List[list], return_exceptions: bool = False,
+                        **kwargs) -> List[CompletionResult]:
+        """
+        Runs many completions concurrently and returns results in input order.
+
+        Accepts the same options as `aiter_many`. Unless `return_exceptions`
+        is set, the first failed completion's error is raised.
+        """
+        results = [None] * len(list_of_messages)
+        # aclosing makes sure pending completions are cancelled if we raise
+        async with aclosing(self.aiter_many(list_of_messages, **kwargs)) as completed:
+            async for result in completed:
+                if result.error is not None and not return_exceptions:
+                    raise result.error
+                results[result.index] = result
+        return results
+
+    def run_many(self, list_of_messages: List[list], **kwargs) -> List[CompletionResult]:
+        """
+        Blocking wrapper around `arun_many` for scripts and offline jobs.
+
+        It starts its own event loop, so it cannot be called while one is
+        running (e.g. in a notebook or an async app): await `arun_many`
+        there instead.
+        """
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return asyncio.run(self.arun_many(list_of_messages, **kwargs))
+        raise RuntimeError(
+            "run_many cannot be called from a running event loop; "
+            "use `await chat_model.arun_many(...)` instead"
+        )
@@ -1,17 +1,54 @@
 from dotenv import load_dotenv
 from openai import AsyncOpenAI, OpenAI
 import openai
-from typing import List
+from concurrent.futures import Future
+from typing import Dict, List, Tuple
 import os
 import asyncio
+import threading
+import time
+
+from aimakerspace.openai_utils.scheduler import (
+    BULK,
+    UpstreamScheduler,
+    backoff_delay,
+    estimate_tokens,
+    get_scheduler,
+    is_retryable,
+)
+
+
+# Requests that are currently in flight, keyed by (model, text). Concurrent
+# callers asking for a text that is already being embedded wait on the
+# existing future instead of issuing a duplicate upstream request. Async
+# futures are bound to an event loop, so the async table is keyed by loop too.
+_async_inflight: Dict[Tuple[asyncio.AbstractEventLoop, str, str], asyncio.Future] = {}
+_sync_inflight: Dict[Tuple[str, str], Future] = {}
+_sync_inflight_lock = threading.Lock()
+# Strong references to detached batch tasks so they are not garbage collected
+_background_tasks = set()
+
+
+def _consume_exception(future) -> None:
+    # Failures are re-raised to every waiter; this only stops asyncio from
+    # logging "exception was never retrieved" when nobody else was waiting.
+    if not future.cancelled():
+        future.exception()
 
 
 class EmbeddingModel:
-    def __init__(self, embeddings_model_name: str = "text-embedding-3-small"):
+    def __init__(
+        self,
+        embeddings_model_name: str = "text-embedding-3-small",
+        batch_size: int = 1024,
+        priority: int = BULK,
+        scheduler: UpstreamScheduler = None,
+        max_retries: int = 2,
+    ):
         load_dotenv()
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
-        self.async_client = AsyncOpenAI()
-        self.client = OpenAI()
+        self._async_client = None
+        self._client = None
 
         if self.openai_api_key is None:
             raise ValueError(
@@ -19,34 +56,170 @@ class EmbeddingModel:
             )
         openai.api_key = self.openai_api_key
         self.embeddings_model_name = embeddings_model_name
+        self.batch_size = batch_size
+        self.priority = priority
+        self.scheduler = scheduler or get_scheduler()
+        # Retries happen here rather than in the SDK, so that every attempt
+        # goes back through the scheduler and each 429 reaches its AIMD logic
+        self.max_retries = max_retries
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        # HTTP clients are built on first use, so constructing a model (and
+        # every VectorDatabase that owns one) costs nothing up front
+        if self._async_client is None:
+            self._async_client = AsyncOpenAI(max_retries=0)
+        return self._async_client
+
+    @property
+    def client(self) -> OpenAI:
+        if self._client is None:
+            self._client = OpenAI(max_retries=0)
+        return self._client
+
+    async def _async_create(self, batch: List[str]):
+        """One upstream embeddings call, retried with backoff on transient errors."""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                async with self.scheduler.aslot(
+                    self.priority,
+                    sum(estimate_tokens(text) for text in batch),
+                    self.embeddings_model_name,
+                ):
+                    raw_response = await self.async_client.embeddings.with_raw_response.create(
+                        input=batch, model=self.embeddings_model_name
+                    )
+                break
+            except Exception as e:
+                if attempt > self.max_retries or not is_retryable(e):
+                    raise
+                await asyncio.sleep(backoff_delay(attempt))
+        self.scheduler.update_from_headers(raw_response.headers, self.embeddings_model_name)
+        return raw_response.parse()
+
+    def _create(self, batch: List[str]):
+        """Synchronous counterpart of `_async_create`."""
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                with self.scheduler.slot(
+                    self.priority,
+                    sum(estimate_tokens(text) for text in batch),
+                    self.embeddings_model_name,
+                ):
+                    raw_response = self.client.embeddings.with_raw_response.create(
+                        input=batch, model=self.embeddings_model_name
+                    )
+                break
+            except Exception as e:
+                if attempt > self.max_retries or not is_retryable(e):
+                    raise
+                time.sleep(backoff_delay(attempt))
+        self.scheduler.update_from_headers(raw_response.headers, self.embeddings_model_name)
+        return raw_response.parse()
+
+    def _batches(self, texts: List[str]) -> List[List[str]]:
+        return [
+            texts[start : start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
 
     async def async_get_embeddings(self, list_of_text: List[str]) -> List[List[float]]:
-        embedding_response = await self.async_client.embeddings.create(
-            input=list_of_text, model=self.embeddings_model_name
-        )
+        """
+        Embeds a list of texts, coalescing with identical requests in flight.
 
-        return [embeddings.embedding for embeddings in embedding_response.data]
+        Texts already being embedded by another caller are shared; only the
+        remaining ones are sent upstream, in batches, and waiters are released
+        as soon as the batch containing their text lands.
+        """
+        loop = asyncio.get_running_loop()
+        futures = {}
+        new_texts = []
+        for text in dict.fromkeys(list_of_text):
+            key = (loop, self.embeddings_model_name, text)
+            future = _async_inflight.get(key)
+            if future is None:
+                future = loop.create_future()
+                future.add_done_callback(_consume_exception)
+                _async_inflight[key] = future
+                new_texts.append(text)
+            futures[text] = future
 
-    async def async_get_embedding(self, text: str) -> List[float]:
-        embedding = await self.async_client.embeddings.create(
-            input=text, model=self.embeddings_model_name
-        )
+        if new_texts:
+            # The upstream work runs in a detached task: cancelling this
+            # caller only stops it waiting, it never cancels batches that
+            # other callers are sharing.
+            task = loop.create_task(self._async_embed_batches(loop, new_texts, futures))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+        # Shield the shared futures so one waiter being cancelled does not
+        # cancel the result for everyone else.
+        return [await asyncio.shield(futures[text]) for text in list_of_text]
 
-        return embedding.data[0].embedding
+    async def _async_embed_batches(self, loop, new_texts: List[str], futures) -> None:
+        """Sends new texts upstream in batches, resolving each batch's futures as it lands."""
+        for index, batch in enumerate(self._batches(new_texts)):
+            try:
+                embedding_response = await self._async_create(batch)
+            except BaseException as e:
+                # Fail this batch and every batch we have not sent yet, so
+                # waiters do not hang on texts that will never be embedded.
+                for text in new_texts[index * self.batch_size :]:
+                    _async_inflight.pop((loop, self.embeddings_model_name, text), None)
+                    if isinstance(e, asyncio.CancelledError):
+                        futures[text].cancel()
+                    else:
+                        futures[text].set_exception(e)
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                return
+
+            for text, embeddings in zip(batch, embedding_response.data):
+                _async_inflight.pop((loop, self.embeddings_model_name, text), None)
+                futures[text].set_result(embeddings.embedding)
+
+    async def async_get_embedding(self, text: str) -> List[float]:
+        return (await self.async_get_embeddings([text]))[0]
 
     def get_embeddings(self, list_of_text: List[str]) -> List[List[float]]:
-        embedding_response = self.client.embeddings.create(
-            input=list_of_text, model=self.embeddings_model_name
-        )
+        """Thread-safe synchronous counterpart of `async_get_embeddings`."""
+        futures = {}
+        new_texts = []
+        with _sync_inflight_lock:
+            for text in dict.fromkeys(list_of_text):
+                key = (self.embeddings_model_name, text)
+                future = _sync_inflight.get(key)
+                if future is None:
+                    future = Future()
+                    _sync_inflight[key] = future
+                    new_texts.append(text)
+                futures[text] = future
 
-        return [embeddings.embedding for embeddings in embedding_response.data]
+        for index, batch in enumerate(self._batches(new_texts)):
+            try:
+                embedding_response = self._create(batch)
+            except BaseException as e:
+                with _sync_inflight_lock:
+                    for text in new_texts[index * self.batch_size :]:
+                        _sync_inflight.pop((self.embeddings_model_name, text), None)
+                for text in new_texts[index * self.batch_size :]:
+                    futures[text].set_exception(e)
+                raise
 
-    def get_embedding(self, text: str) -> List[float]:
-        embedding = self.client.embeddings.create(
-            input=text, model=self.embeddings_model_name
-        )
+            with _sync_inflight_lock:
+                for text in batch:
+                    _sync_inflight.pop((self.embeddings_model_name, text), None)
+            for text, embeddings in zip(batch, embedding_response.data):
+                futures[text].set_result(embeddings.embedding)
 
-        return embedding.data[0].embedding
+        return [futures[text].result() for text in list_of_text]
+
+    def get_embedding(self, text: str) -> List[float]:
+        return self.get_embeddings([text])[0]
 
 
 if __name__ == "__main__":
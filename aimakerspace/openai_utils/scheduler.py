@@ -0,0 +1,410 @@
+import asyncio
+import bisect
+import itertools
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Optional
+
+
+# Priority classes, lower runs first. Interactive chat always jumps ahead of
+# queued bulk ingestion work.
+INTERACTIVE = 0
+BULK = 1
+
+_PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Budget key used when a caller does not name a model
+DEFAULT_MODEL = "default"
+
+# Upper bound on how long a waiter sleeps before re-checking the queue, so a
+# missed wake-up or a budget refill can never stall it indefinitely.
+_MAX_POLL_SECONDS = 1.0
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_reset_duration(value: str) -> Optional[float]:
+    """
+    Parses OpenAI reset headers such as "1s", "6m0s" or "20ms" into seconds.
+
+    :param value: The raw header value
+    :return: The duration in seconds, or None if it cannot be parsed
+    """
+    parts = _DURATION_PART.findall(value or "")
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token estimate (about four characters per token) for budgeting."""
+    return len(text) // 4 + 1
+
+
+def _is_rate_limited(error: BaseException) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+def is_retryable(error: BaseException) -> bool:
+    """True for rate limits, timeouts, connection errors and 5xx responses."""
+    # Imported here so the scheduler itself stays free of the OpenAI SDK
+    from openai import APIConnectionError
+
+    if isinstance(error, APIConnectionError):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code in (408, 409, 429) or (status_code is not None and status_code >= 500)
+
+
+def backoff_delay(attempt: int, base_delay: float = 1.0) -> float:
+    """Exponential backoff with full jitter for the given 1-based attempt."""
+    return random.uniform(0, base_delay * 2 ** (attempt - 1))
+
+
+class _Budget:
+    """Per-model request and token budget, refilled continuously per minute."""
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.request_allowance = float(requests_per_minute)
+        self.token_allowance = float(tokens_per_minute)
+        self.refilled_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def refill(self, now: float) -> None:
+        elapsed = now - self.refilled_at
+        self.refilled_at = now
+        self.request_allowance = min(
+            self.requests_per_minute,
+            self.request_allowance + elapsed * self.requests_per_minute / 60.0,
+        )
+        self.token_allowance = min(
+            self.tokens_per_minute,
+            self.token_allowance + elapsed * self.tokens_per_minute / 60.0,
+        )
+
+    def delay(self, tokens: int, now: float) -> Optional[float]:
+        """Returns None if a call of `tokens` fits now, else seconds until it might."""
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        tokens = min(tokens, self.tokens_per_minute)
+        if self.request_allowance < 1:
+            return (1 - self.request_allowance) * 60.0 / self.requests_per_minute
+        if self.token_allowance < tokens:
+            return (tokens - self.token_allowance) * 60.0 / self.tokens_per_minute
+        return None
+
+    def spend(self, tokens: int) -> None:
+        self.request_allowance -= 1
+        self.token_allowance -= min(tokens, self.tokens_per_minute)
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "tokens", "model", "enqueued_at", "wake")
+
+    def __init__(self, priority: int, seq: int, tokens: int, model: str, wake):
+        self.priority = priority
+        self.seq = seq
+        self.tokens = tokens
+        self.model = model
+        self.enqueued_at = time.monotonic()
+        self.wake = wake
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class UpstreamScheduler:
+    """
+    Shared gate in front of every OpenAI call made by this package.
+
+    It keeps a per-minute request and token budget for each model (OpenAI
+    limits are per model, so a drained embedding budget never throttles
+    chat), adapts the number of concurrent upstream calls AIMD-style
+    (additive increase on success, multiplicative decrease on 429s) and
+    serves waiters in priority order. Bulk work may only use `bulk_share` of
+    the concurrency limit, so a chat request arriving during a large ingest
+    finds a free slot straight away. Both sync (thread) and async callers
+    are supported.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: int = 500,
+        tokens_per_minute: int = 200_000,
+        max_concurrency: int = 32,
+        min_concurrency: int = 1,
+        initial_concurrency: int = 8,
+        bulk_share: float = 0.75,
+    ):
+        # Starting budget for each model until its rate-limit headers arrive
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.bulk_share = bulk_share
+
+        self._lock = threading.Lock()
+        self._queue = []
+        self._seq = itertools.count()
+        self._limit = max(min_concurrency, min(initial_concurrency, max_concurrency))
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._in_flight = {INTERACTIVE: 0, BULK: 0}
+        self._budgets: Dict[str, _Budget] = {}
+        self._rate_limited = 0
+        self._wait_times = {INTERACTIVE: deque(maxlen=1000), BULK: deque(maxlen=1000)}
+
+    @classmethod
+    def from_env(cls) -> "UpstreamScheduler":
+        """Builds a scheduler configured from OPENAI_* limit environment variables."""
+        return cls(
+            requests_per_minute=int(os.getenv("OPENAI_RPM_LIMIT", "500")),
+            tokens_per_minute=int(os.getenv("OPENAI_TPM_LIMIT", "200000")),
+            max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", "32")),
+        )
+
+    # Budget and admission, all called with self._lock held.
+
+    def _budget(self, model: Optional[str]) -> _Budget:
+        model = model or DEFAULT_MODEL
+        budget = self._budgets.get(model)
+        if budget is None:
+            budget = self._budgets[model] = _Budget(
+                self.requests_per_minute, self.tokens_per_minute
+            )
+        return budget
+
+    def _bulk_limit(self) -> int:
+        return max(1, int(self._limit * self.bulk_share))
+
+    def _has_room(self, priority: int) -> bool:
+        if sum(self._in_flight.values()) >= self._limit:
+            return False
+        return priority != BULK or self._in_flight[BULK] < self._bulk_limit()
+
+    def _try_grant(self, waiter: _Waiter) -> Optional[float]:
+        """Grants a slot to `waiter` and returns None, or returns how long to wait."""
+        now = time.monotonic()
+        if not self._has_room(waiter.priority):
+            return _MAX_POLL_SECONDS
+        # Waiters ahead go first, unless they are only held back by their
+        # own model's budget: that must not block calls to other models.
+        for ahead in self._queue:
+            if ahead is waiter:
+                break
+            budget = self._budget(ahead.model)
+            budget.refill(now)
+            if self._has_room(ahead.priority) and budget.delay(ahead.tokens, now) is None:
+                return _MAX_POLL_SECONDS
+
+        budget = self._budget(waiter.model)
+        budget.refill(now)
+        delay = budget.delay(waiter.tokens, now)
+        if delay is not None:
+            return delay
+
+        self._queue.remove(waiter)
+        budget.spend(waiter.tokens)
+        self._in_flight[waiter.priority] += 1
+        self._wait_times[waiter.priority].append(now - waiter.enqueued_at)
+        self._wake_next()
+        return None
+
+    def _wake_next(self) -> None:
+        # Wake the first waiter for each model; the others are behind it in
+        # the same budget and would only re-check and sleep again
+        seen = set()
+        for waiter in self._queue:
+            if waiter.model not in seen:
+                seen.add(waiter.model)
+                waiter.wake()
+
+    def _enqueue(self, priority: int, tokens: int, model: Optional[str], wake) -> _Waiter:
+        waiter = _Waiter(priority, next(self._seq), tokens, model or DEFAULT_MODEL, wake)
+        bisect.insort(self._queue, waiter)
+        return waiter
+
+    def _abandon(self, waiter: _Waiter) -> None:
+        if waiter in self._queue:
+            self._queue.remove(waiter)
+            self._wake_next()
+
+    def _release(self, priority: int, model: Optional[str], error: Optional[BaseException]) -> None:
+        with self._lock:
+            self._in_flight[priority] -= 1
+            if error is None:
+                self._successes += 1
+                if self._successes >= self._limit:
+                    self._limit = min(self.max_concurrency, self._limit + 1)
+                    self._successes = 0
+            elif _is_rate_limited(error):
+                self._record_rate_limit(model, getattr(error, "response", None))
+            self._wake_next()
+
+    def _record_rate_limit(self, model: Optional[str], response) -> None:
+        now = time.monotonic()
+        self._rate_limited += 1
+        # A burst of 429s from requests that were already in flight counts
+        # as one congestion signal rather than halving the limit repeatedly.
+        if now - self._last_decrease > 1.0:
+            self._limit = max(self.min_concurrency, self._limit // 2)
+            self._successes = 0
+            self._last_decrease = now
+        headers = getattr(response, "headers", None) or {}
+        retry_after = headers.get("retry-after")
+        try:
+            delay = float(retry_after) if retry_after is not None else 1.0
+        except ValueError:
+            delay = 1.0
+        # Only the rate-limited model is paused
+        budget = self._budget(model)
+        budget.blocked_until = max(budget.blocked_until, now + delay)
+
+    # Public API
+
+    def update_from_headers(self, headers, model: str = None) -> None:
+        """
+        Narrows a model's local budget to what OpenAI reports as remaining.
+
+        :param headers: Response headers containing x-ratelimit-* values
+        :param model: The model the response came from
+        """
+        if not headers:
+            return
+        with self._lock:
+            budget = self._budget(model)
+            budget.refill(time.monotonic())
+            for kind, attr, limit_attr in (
+                ("requests", "request_allowance", "requests_per_minute"),
+                ("tokens", "token_allowance", "tokens_per_minute"),
+            ):
+                limit = headers.get(f"x-ratelimit-limit-{kind}")
+                if limit is not None and limit.isdigit():
+                    setattr(budget, limit_attr, int(limit))
+                remaining = headers.get(f"x-ratelimit-remaining-{kind}")
+                if remaining is not None and remaining.isdigit():
+                    setattr(budget, attr, min(getattr(budget, attr), float(remaining)))
+
+    @contextmanager
+    def slot(self, priority: int = BULK, tokens: int = 0, model: str = None):
+        """
+        Blocks the calling thread until an upstream slot is available.
+
+        :param priority: INTERACTIVE or BULK
+        :param tokens: Estimated tokens the call will consume
+        :param model: The model being called, whose budget is charged
+        """
+        event = threading.Event()
+        with self._lock:
+            waiter = self._enqueue(priority, tokens, model, event.set)
+        try:
+            while True:
+                with self._lock:
+                    delay = self._try_grant(waiter)
+                if delay is None:
+                    break
+                event.wait(min(delay, _MAX_POLL_SECONDS))
+                event.clear()
+        except BaseException:
+            with self._lock:
+                self._abandon(waiter)
+            raise
+
+        try:
+            yield
+        except BaseException as e:
+            self._release(priority, model, e)
+            raise
+        self._release(priority, model, None)
+
+    @asynccontextmanager
+    async def aslot(self, priority: int = BULK, tokens: int = 0, model: str = None):
+        """
+        Async counterpart of `slot`; waits without blocking the event loop.
+
+        :param priority: INTERACTIVE or BULK
+        :param tokens: Estimated tokens the call will consume
+        :param model: The model being called, whose budget is charged
+        """
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+
+        def wake():
+            loop.call_soon_threadsafe(event.set)
+
+        with self._lock:
+            waiter = self._enqueue(priority, tokens, model, wake)
+        try:
+            while True:
+                with self._lock:
+                    delay = self._try_grant(waiter)
+                if delay is None:
+                    break
+                try:
+                    await asyncio.wait_for(event.wait(), min(delay, _MAX_POLL_SECONDS))
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+        except BaseException:
+            with self._lock:
+                self._abandon(waiter)
+            raise
+
+        try:
+            yield
+        except BaseException as e:
+            self._release(priority, model, e)
+            raise
+        self._release(priority, model, None)
+
+    def stats(self) -> Dict:
+        """Returns concurrency, per-model budget, queue depth and wait-time statistics."""
+        with self._lock:
+            now = time.monotonic()
+            budgets = {}
+            for model, budget in self._budgets.items():
+                budget.refill(now)
+                budgets[model] = {
+                    "requests_remaining": int(budget.request_allowance),
+                    "tokens_remaining": int(budget.token_allowance),
+                    "blocked_for_ms": round(max(0.0, budget.blocked_until - now) * 1000, 2),
+                }
+            queues = {}
+            for priority, name in _PRIORITY_NAMES.items():
+                waits = sorted(self._wait_times[priority])
+                queues[name] = {
+                    "queued": sum(1 for w in self._queue if w.priority == priority),
+                    "in_flight": self._in_flight[priority],
+                    "granted": len(waits),
+                    "wait_mean_ms": round(1000 * sum(waits) / len(waits), 2) if waits else 0.0,
+                    "wait_p95_ms": round(1000 * waits[int(0.95 * (len(waits) - 1))], 2) if waits else 0.0,
+                    "wait_max_ms": round(1000 * waits[-1], 2) if waits else 0.0,
+                }
+            return {
+                "concurrency_limit": self._limit,
+                "bulk_limit": self._bulk_limit(),
+                "rate_limited": self._rate_limited,
+                "budgets": budgets,
+                "queues": queues,
+            }
+
+
+_default_scheduler: Optional[UpstreamScheduler] = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> UpstreamScheduler:
+    """Returns the process-wide scheduler shared by EmbeddingModel and ChatOpenAI."""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = UpstreamScheduler.from_env()
+        return _default_scheduler
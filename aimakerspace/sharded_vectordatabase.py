@@ -0,0 +1,250 @@
+"""
+A VectorDatabase that partitions its vectors across N shards.
+
+Each shard keeps its vectors in one contiguous float32 matrix, so scoring a
+shard is a single matrix-vector product. NumPy releases the GIL for that,
+which lets a thread pool score every shard in parallel on separate cores;
+the per-shard top-k lists are then merged with a heap.
+
+Rows are append-only: an update writes a new row and a delete only marks
+the old one dead, so a search takes a snapshot under the shard lock and
+scores it without holding the lock. Concurrent searches therefore run in
+parallel with each other and with inserts.
+
+Whether sharding helps depends on the machine: with a multithreaded BLAS a
+single large product may already use every core. Run
+
+    python -m aimakerspace.sharded_vectordatabase
+
+to time search across shard counts on the target machine.
+"""
+
+import heapq
+import os
+import threading
+import time
+import zlib
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+from aimakerspace.openai_utils.embedding import EmbeddingModel
+from aimakerspace.vectordatabase import VectorDatabase, cosine_similarity, key_source
+
+# Dead rows are dropped once there are at least this many and they
+# outnumber the live ones
+_COMPACT_MIN_DEAD = 1024
+
+
+class _Shard:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Row -> key, with None for dead rows; rows only ever get appended
+        self.keys: List[Optional[str]] = []
+        self.rows = {}
+        self.matrix = None
+        self.norms = None
+        self.dead = 0
+
+    def insert(self, key: str, vector: np.array) -> None:
+        vector = np.asarray(vector, dtype=np.float32)
+        with self.lock:
+            old_row = self.rows.get(key)
+            if old_row is not None:
+                self._retire(old_row)
+            row = len(self.keys)
+            if self.matrix is None:
+                self.matrix = np.empty((16, vector.shape[0]), dtype=np.float32)
+                self.norms = np.empty(16, dtype=np.float32)
+            elif row == self.matrix.shape[0]:
+                # Grow geometrically into new arrays, so inserts stay
+                # amortized O(1) and snapshots held by searches stay valid
+                capacity = max(16, 2 * row)
+                matrix = np.empty((capacity, self.matrix.shape[1]), dtype=np.float32)
+                norms = np.empty(capacity, dtype=np.float32)
+                matrix[:row] = self.matrix[:row]
+                norms[:row] = self.norms[:row]
+                self.matrix, self.norms = matrix, norms
+            self.matrix[row] = vector
+            self.norms[row] = np.linalg.norm(vector)
+            self.rows[key] = row
+            self.keys.append(key)
+            self._maybe_compact()
+
+    def delete(self, key: str) -> None:
+        with self.lock:
+            row = self.rows.pop(key, None)
+            if row is not None:
+                self._retire(row)
+                self._maybe_compact()
+
+    def _retire(self, row: int) -> None:
+        self.keys[row] = None
+        self.norms[row] = 0.0
+        self.dead += 1
+
+    def _maybe_compact(self) -> None:
+        if self.dead < _COMPACT_MIN_DEAD or self.dead < len(self.rows):
+            return
+        # Build new arrays rather than moving rows, so snapshots stay valid
+        live = np.array([row for row, key in enumerate(self.keys) if key is not None], dtype=np.int64)
+        self.matrix = self.matrix[live]
+        self.norms = self.norms[live]
+        self.keys = [self.keys[row] for row in live]
+        self.rows = {key: row for row, key in enumerate(self.keys)}
+        self.dead = 0
+
+    def get(self, key: str):
+        with self.lock:
+            row = self.rows.get(key)
+            return None if row is None else self.matrix[row].copy()
+
+    def top_k(self, query: np.ndarray, k: int, distance_measure: Callable) -> List[Tuple[float, str]]:
+        # Rows below `size` never change, so only the norms (which a delete
+        # zeroes) need copying; the matrix product runs without the lock
+        with self.lock:
+            size = len(self.keys)
+            if size == 0:
+                return []
+            matrix, keys, norms = self.matrix, self.keys, self.norms[:size].copy()
+
+        if distance_measure is not cosine_similarity:
+            scores = [
+                (distance_measure(query, matrix[row]), keys[row])
+                for row in range(size)
+                if keys[row] is not None
+            ]
+            return heapq.nlargest(k, scores)
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = (matrix[:size] @ query) / (norms * np.linalg.norm(query))
+        scores[norms == 0] = -np.inf
+        k = min(k, int(np.count_nonzero(norms)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        # A row deleted since the snapshot has lost its key; skip it
+        return [(float(scores[row]), keys[row]) for row in top if keys[row] is not None]
+
+
+class _ShardedVectors(Mapping):
+    """Read-only key -> vector view across all shards."""
+
+    def __init__(self, db: "ShardedVectorDatabase"):
+        self._db = db
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        vector = self._db.retrieve_from_key(key)
+        if vector is None:
+            raise KeyError(key)
+        return vector
+
+    def __iter__(self):
+        for shard in self._db.shards:
+            with shard.lock:
+                keys = list(shard.rows)
+            yield from keys
+
+    def __len__(self) -> int:
+        return sum(len(shard.rows) for shard in self._db.shards)
+
+    def __contains__(self, key) -> bool:
+        return key in self._db._shard_for(key).rows
+
+
+class ShardedVectorDatabase(VectorDatabase):
+    def __init__(
+        self,
+        embedding_model: EmbeddingModel = None,
+        num_shards: int = None,
+        partition: str = "hash",
+    ):
+        """
+        :param embedding_model: Model used by search_by_text and abuild_from_list
+        :param num_shards: Number of shards (default: one per core)
+        :param partition: "hash" spreads keys evenly; "source" keeps all chunks
+            of one "[source] ..." file together in one shard
+        """
+        if partition not in ("hash", "source"):
+            raise ValueError("partition must be 'hash' or 'source'")
+        self.embedding_model = embedding_model or EmbeddingModel()
+        self.partition = partition
+        self.shards = [_Shard() for _ in range(num_shards or os.cpu_count() or 1)]
+        self._executor = ThreadPoolExecutor(len(self.shards))
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        embedding_model: EmbeddingModel = None,
+        num_shards: int = None,
+        partition: str = "hash",
+    ) -> "ShardedVectorDatabase":
+        """Loads an index written with `save` into num_shards shards."""
+        return super().load(path, embedding_model, num_shards=num_shards, partition=partition)
+
+    def close(self) -> None:
+        """Stops the search thread pool; the database cannot be searched afterwards."""
+        self._executor.shutdown(wait=True)
+
+    def __enter__(self) -> "ShardedVectorDatabase":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @property
+    def vectors(self) -> Mapping:
+        return _ShardedVectors(self)
+
+    def _shard_for(self, key: str) -> _Shard:
+        if self.partition == "source":
+            key = key_source(key) or key
+        return self.shards[zlib.crc32(key.encode("utf-8")) % len(self.shards)]
+
+    def insert(self, key: str, vector: np.array) -> None:
+        self._shard_for(key).insert(key, vector)
+
+    def delete(self, key: str) -> None:
+        self._shard_for(key).delete(key)
+
+    def retrieve_from_key(self, key: str) -> np.array:
+        return self._shard_for(key).get(key)
+
+    def search(
+        self,
+        query_vector: np.array,
+        k: int,
+        distance_measure: Callable = cosine_similarity,
+    ) -> List[Tuple[str, float]]:
+        query = np.asarray(query_vector, dtype=np.float32)
+        per_shard = self._executor.map(
+            lambda shard: shard.top_k(query, k, distance_measure), self.shards
+        )
+        merged = heapq.nlargest(k, (hit for hits in per_shard for hit in hits))
+        return [(key, score) for score, key in merged]
+
+
+def benchmark(num_vectors: int = 200_000, dim: int = 1536, k: int = 5, queries: int = 20) -> None:
+    """Prints mean search latency for a range of shard counts."""
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((num_vectors, dim), dtype=np.float32)
+    query_vectors = rng.standard_normal((queries, dim), dtype=np.float32)
+    cores = os.cpu_count() or 1
+    for num_shards in sorted({1, 2, 4, cores}):
+        # Searching by vector needs no embedding model (or API key)
+        with ShardedVectorDatabase(embedding_model=object(), num_shards=num_shards) as db:
+            for i, vector in enumerate(vectors):
+                db.insert(str(i), vector)
+            db.search(query_vectors[0], k)
+            started = time.perf_counter()
+            for query in query_vectors:
+                db.search(query, k)
+            elapsed = (time.perf_counter() - started) / queries
+        print(f"{num_shards:>3} shards: {elapsed * 1000:8.2f} ms/query ({num_vectors} x {dim}, {cores} cores)")
+
+
+if __name__ == "__main__":
+    benchmark()
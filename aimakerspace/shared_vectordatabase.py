@@ -0,0 +1,523 @@
+"""
+A VectorDatabase whose vectors and keys live in one shared memory segment.
+
+The segment is a file mapped with mmap, by default under /dev/shm (so it is
+RAM-backed). Every process that opens the same path maps the same pages:
+several uvicorn workers then hold one copy of the index between them, and
+each sees documents inserted by the others without rebuilding anything.
+
+Layout: a header, then per-row vectors, norms, key references and live
+flags, an open-addressing hash table from key to row, and an append-only
+log of key records. Processes keep no per-key state of their own, so the
+memory used for keys does not grow with the number of workers either.
+
+Protocol:
+
+* Writers are serialized with an exclusive flock on "<path>.lock", so there
+  is only ever one writer, in whichever process is inserting.
+* The header holds a generation counter used as a seqlock: the writer makes
+  it odd before changing anything and even again once the new rows and keys
+  are published. Header fields are written one aligned 8-byte word at a
+  time, the generation last. Lookups read the generation, then the header,
+  probe the hash table and retry if the generation was odd or changed.
+* Rows and key records are append-only, so a published row never changes
+  and search can read vectors without holding the seqlock. Re-inserting a
+  key writes a new row; deletes append a tombstone record. Either way the
+  old row is marked dead and its norm zeroed, so search skips it.
+* A writer that dies mid-transaction leaves the generation odd. The next
+  writer, or a reader that has waited too long, takes the lock, replays the
+  published key records to restore the live flags, norms and hash table,
+  and republishes the header, which still describes the last complete state.
+* When the segment is full the writer copies it into a segment twice the
+  size, swaps it in with os.replace and marks the old one as retired, which
+  tells readers to re-map the path.
+"""
+
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from collections import namedtuple
+from collections.abc import Mapping
+from contextlib import contextmanager
+from typing import Any, Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from aimakerspace.openai_utils.embedding import EmbeddingModel
+from aimakerspace.vectordatabase import VectorDatabase, cosine_similarity
+
+_MAGIC = b"AIMSVDB2"
+_Header = namedtuple(
+    "_Header", "magic generation retired count dim capacity meta_used meta_capacity live"
+)
+_HEADER = struct.Struct("<8sQQQQQQQQ")
+_HEADER_SIZE = 4096
+_RECORD = struct.Struct("<BI")
+_INSERT, _DELETE = 0, 1
+# How long a reader waits on an odd generation before suspecting a dead writer
+_STALL_TIMEOUT = 0.5
+
+
+def default_shared_path() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.path.join(base, "aimakerspace-vectors")
+
+
+def _align(offset: int) -> int:
+    return (offset + 63) & ~63
+
+
+def _table_size(capacity: int) -> int:
+    # At most half full, so probe sequences stay short
+    size = 1
+    while size < 2 * capacity:
+        size *= 2
+    return size
+
+
+def _layout(dim: int, capacity: int, meta_capacity: int) -> Tuple[int, ...]:
+    """Offsets of vectors, norms, key refs, live flags, hash table and key log, plus the size."""
+    vectors = _HEADER_SIZE
+    norms = _align(vectors + capacity * dim * 4)
+    refs = _align(norms + capacity * 4)
+    alive = _align(refs + capacity * 16)
+    table = _align(alive + capacity)
+    meta = _align(table + _table_size(capacity) * 8)
+    return vectors, norms, refs, alive, table, meta, meta + meta_capacity
+
+
+class _Segment:
+    """One mapped segment file; offsets of each region are derived from the header."""
+
+    def __init__(self, path: str):
+        self.file = open(path, "r+b")
+        self.inode = os.fstat(self.file.fileno()).st_ino
+        self.map = mmap.mmap(self.file.fileno(), 0)
+        if self.map[:8] != _MAGIC:
+            raise ValueError("Not a shared vector index segment")
+        # The header fields after the magic, as words that are each written
+        # with a single store
+        self.fields = np.frombuffer(self.map, dtype=np.uint64, count=len(_Header._fields) - 1, offset=8)
+        header = self.read_header()
+        self.dim, self.capacity, self.meta_capacity = header.dim, header.capacity, header.meta_capacity
+        self.table_size = _table_size(self.capacity)
+        vectors, norms, refs, alive, table, self.meta_offset, _ = _layout(
+            self.dim, self.capacity, self.meta_capacity
+        )
+        view = lambda dtype, count, offset: np.frombuffer(self.map, dtype=dtype, count=count, offset=offset)
+        self.vectors = view(np.float32, self.capacity * self.dim, vectors).reshape(self.capacity, self.dim)
+        self.norms = view(np.float32, self.capacity, norms)
+        # (offset into the key log, length) of each row's key
+        self.refs = view(np.uint64, self.capacity * 2, refs).reshape(self.capacity, 2)
+        self.alive = view(np.uint8, self.capacity, alive)
+        # row + 1 per slot, 0 for an empty slot
+        self.table = view(np.int64, self.table_size, table)
+
+    @staticmethod
+    def create(path: str, dim: int, capacity: int, meta_capacity: int) -> None:
+        with open(path, "wb") as f:
+            f.truncate(_layout(dim, capacity, meta_capacity)[-1])
+            f.write(_HEADER.pack(_MAGIC, 0, 0, 0, dim, capacity, 0, meta_capacity, 0))
+
+    def generation(self) -> int:
+        return int(self.fields[0])
+
+    def read_header(self) -> _Header:
+        return _Header(_MAGIC, *(int(value) for value in self.fields))
+
+    def update(self, **fields: int) -> None:
+        """
+        Writes header fields in place, the generation last.
+
+        struct.pack_into would clear the whole header before filling it in,
+        so readers could briefly see a zero generation next to stale fields.
+        """
+        generation = fields.pop("generation", None)
+        for name, value in fields.items():
+            self.fields[_Header._fields.index(name) - 1] = value
+        if generation is not None:
+            self.fields[0] = generation
+
+    def key_bytes(self, row: int) -> bytes:
+        offset, length = (int(value) for value in self.refs[row])
+        start = self.meta_offset + offset
+        return self.map[start : start + length]
+
+    def key_at(self, row: int) -> str:
+        return self.key_bytes(row).decode("utf-8")
+
+    def lookup(self, encoded: bytes, count: int) -> Tuple[Optional[int], int]:
+        """
+        Probes the hash table for a key among the first `count` rows.
+
+        Returns (row, slot); row is None if the key has no slot yet, and slot
+        is then where it would go. The row may be dead.
+        """
+        mask = self.table_size - 1
+        slot = zlib.crc32(encoded) & mask
+        while True:
+            entry = int(self.table[slot])
+            if entry == 0:
+                return None, slot
+            # Entries for rows not yet published belong to a write in progress
+            if entry - 1 < count and self.key_bytes(entry - 1) == encoded:
+                return entry - 1, slot
+            slot = (slot + 1) & mask
+
+    def rebuild_table(self, count: int) -> None:
+        self.table[:] = 0
+        mask = self.table_size - 1
+        for row in np.flatnonzero(self.alive[:count]):
+            slot = zlib.crc32(self.key_bytes(row)) & mask
+            while self.table[slot]:
+                slot = (slot + 1) & mask
+            self.table[slot] = row + 1
+
+    def close(self) -> None:
+        # The map itself is released once no numpy view of it is left, so
+        # searches still holding views of a retired segment stay valid
+        self.file.close()
+
+
+class _SharedVectors(Mapping):
+    """Read-only key -> vector view, so code written against `vectors` keeps working."""
+
+    def __init__(self, db: "SharedVectorDatabase"):
+        self._db = db
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        vector = self._db.retrieve_from_key(key)
+        if vector is None:
+            raise KeyError(key)
+        return vector
+
+    def __iter__(self):
+        return iter(self._db._read(
+            lambda segment, header: [segment.key_at(row) for row in np.flatnonzero(segment.alive[: header.count])]
+        ))
+
+    def __len__(self) -> int:
+        return self._db._read(lambda segment, header: header.live)
+
+    def __contains__(self, key) -> bool:
+        return self._db._live_row(key) is not None
+
+
+class SharedVectorDatabase(VectorDatabase):
+    def __init__(
+        self,
+        path: str = None,
+        embedding_model: EmbeddingModel = None,
+        dim: int = None,
+        initial_capacity: int = 4096,
+    ):
+        """
+        :param path: Segment file (default: VECTOR_INDEX_SHARED_PATH, or under /dev/shm)
+        :param embedding_model: Model used by search_by_text and abuild_from_list
+        :param dim: Vector dimension; by default it is taken from the first
+            vectors inserted. An existing segment must match it.
+        :param initial_capacity: Rows to allocate when creating the segment
+        """
+        self.path = path or os.getenv("VECTOR_INDEX_SHARED_PATH") or default_shared_path()
+        self.embedding_model = embedding_model or EmbeddingModel()
+        self._local_lock = threading.RLock()
+        self._lock_file = open(self.path + ".lock", "a+b")
+
+        with self._write_lock():
+            if not os.path.exists(self.path):
+                _Segment.create(self.path, dim or 0, initial_capacity, initial_capacity * 256)
+            self._segment = _Segment(self.path)
+        if dim and self._segment.dim and dim != self._segment.dim:
+            raise ValueError(
+                f"The shared index at {self.path} holds {self._segment.dim}-dimensional "
+                f"vectors, not {dim}-dimensional ones"
+            )
+
+    @property
+    def vectors(self) -> Mapping:
+        return _SharedVectors(self)
+
+    # Reader side
+
+    def _current(self) -> _Segment:
+        """This process's mapping of the segment, re-mapped if it was replaced."""
+        with self._local_lock:
+            segment = self._segment
+            if segment.read_header().retired or os.stat(self.path).st_ino != segment.inode:
+                segment.close()
+                segment = self._segment = _Segment(self.path)
+            return segment
+
+    def _read(self, func: Callable[[_Segment, _Header], Any]) -> Any:
+        """
+        Runs func(segment, header) under the seqlock and returns its result.
+
+        func is retried if a write happens meanwhile. A write that looks in
+        progress for too long is waited for, or repaired, under the lock.
+        """
+        deadline = time.monotonic() + _STALL_TIMEOUT
+        while True:
+            segment = self._current()
+            generation = segment.generation()
+            header = segment.read_header()
+            if header.retired or header.generation != generation:
+                continue
+            if generation % 2:
+                if time.monotonic() > deadline:
+                    with self._write_lock():
+                        self._repair(self._current())
+                    deadline = time.monotonic() + _STALL_TIMEOUT
+                else:
+                    time.sleep(0)
+                continue
+            try:
+                result = func(segment, header)
+            except Exception:
+                # A torn read while a writer was busy; anything else is real
+                if segment.generation() == generation:
+                    raise
+                continue
+            if segment.generation() == generation:
+                return result
+
+    def _live_row(self, key: str) -> Optional[Tuple[_Segment, int]]:
+        encoded = key.encode("utf-8")
+
+        def find(segment, header):
+            row, _ = segment.lookup(encoded, header.count)
+            if row is None or not segment.alive[row]:
+                return None
+            return segment, row
+
+        return self._read(find)
+
+    # Writer side
+
+    @contextmanager
+    def _write_lock(self):
+        """Exclusive across threads (RLock) and processes (flock)."""
+        with self._local_lock:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _repair(self, segment: _Segment) -> None:
+        """
+        Completes a transaction abandoned by a writer that died; needs the write lock.
+        """
+        header = segment.read_header()
+        if header.generation % 2 == 0:
+            return
+        # count and meta_used are only advanced when a transaction is
+        # published, so the header still describes the last complete state.
+        # The dead writer may have changed live flags, norms and hash slots
+        # though, so rebuild those from the published key records: the n-th
+        # insert record is row n.
+        log = segment.map[segment.meta_offset : segment.meta_offset + header.meta_used]
+        rows = {}
+        row = offset = 0
+        while offset < len(log):
+            op, length = _RECORD.unpack_from(log, offset)
+            offset += _RECORD.size
+            key = log[offset : offset + length]
+            offset += length
+            if op == _INSERT:
+                rows[key] = row
+                row += 1
+            else:
+                rows.pop(key, None)
+
+        live = np.fromiter(rows.values(), dtype=np.int64, count=len(rows))
+        segment.alive[: header.count] = 0
+        segment.alive[live] = 1
+        segment.norms[: header.count] = 0.0
+        segment.norms[live] = np.linalg.norm(segment.vectors[live], axis=1)
+        segment.rebuild_table(header.count)
+        segment.update(live=len(rows), generation=header.generation + 1)
+
+    def _grow(self, segment: _Segment, rows_needed: int, meta_needed: int, dim: int) -> _Segment:
+        header = segment.read_header()
+        capacity, meta_capacity = max(header.capacity, 1), max(header.meta_capacity, 1)
+        while capacity < header.count + rows_needed:
+            capacity *= 2
+        while meta_capacity < header.meta_used + meta_needed:
+            meta_capacity *= 2
+
+        tmp_path = self.path + ".grow"
+        _Segment.create(tmp_path, dim, capacity, meta_capacity)
+        new = _Segment(tmp_path)
+        count = header.count
+        # The dimension only changes while the index has no vectors yet
+        if header.dim == dim:
+            new.vectors[:count] = segment.vectors[:count]
+        new.norms[:count] = segment.norms[:count]
+        new.refs[:count] = segment.refs[:count]
+        new.alive[:count] = segment.alive[:count]
+        new.map[new.meta_offset : new.meta_offset + header.meta_used] = segment.map[
+            segment.meta_offset : segment.meta_offset + header.meta_used
+        ]
+        new.rebuild_table(count)
+        new.update(
+            generation=header.generation, count=count, meta_used=header.meta_used, live=header.live
+        )
+        new.map.flush()
+        os.replace(tmp_path, self.path)
+        segment.update(retired=1)
+        new.close()
+        return self._current()
+
+    def insert_many(self, items: Iterable[Tuple[str, np.ndarray]]) -> None:
+        """Inserts (key, vector) pairs in a single write transaction."""
+        items = [
+            (key.encode("utf-8"), np.asarray(vector, dtype=np.float32)) for key, vector in items
+        ]
+        if not items:
+            return
+        dims = {vector.shape for _, vector in items}
+        if len(dims) != 1 or len(next(iter(dims))) != 1:
+            raise ValueError("Vectors must be one-dimensional and all of the same length")
+        dim = items[0][1].shape[0]
+
+        with self._write_lock():
+            segment = self._current()
+            self._repair(segment)
+            header = segment.read_header()
+            if header.dim and header.dim != dim:
+                raise ValueError(
+                    f"The shared index at {self.path} holds {header.dim}-dimensional "
+                    f"vectors, not {dim}-dimensional ones"
+                )
+            records = [_RECORD.pack(_INSERT, len(encoded)) + encoded for encoded, _ in items]
+            meta_needed = sum(len(record) for record in records)
+            if (
+                not header.dim
+                or header.count + len(items) > header.capacity
+                or header.meta_used + meta_needed > header.meta_capacity
+            ):
+                segment = self._grow(segment, len(items), meta_needed, dim)
+                header = segment.read_header()
+
+            segment.update(generation=header.generation + 1)
+            count, meta_used, live = header.count, header.meta_used, header.live
+            for (encoded, vector), record in zip(items, records):
+                start = segment.meta_offset + meta_used
+                segment.map[start : start + len(record)] = record
+                # Published rows are never overwritten: a new version of a
+                # key gets a new row and the old one is retired
+                segment.vectors[count] = vector
+                segment.norms[count] = np.linalg.norm(vector)
+                segment.refs[count] = (meta_used + _RECORD.size, len(encoded))
+                segment.alive[count] = 1
+                meta_used += len(record)
+                old_row, slot = segment.lookup(encoded, count)
+                if old_row is not None and segment.alive[old_row]:
+                    segment.alive[old_row] = 0
+                    segment.norms[old_row] = 0.0
+                    live -= 1
+                segment.table[slot] = count + 1
+                count += 1
+                live += 1
+            segment.update(count=count, meta_used=meta_used, live=live, generation=header.generation + 2)
+
+    def insert(self, key: str, vector: np.array) -> None:
+        self.insert_many([(key, vector)])
+
+    def delete(self, key: str) -> None:
+        encoded = key.encode("utf-8")
+        record = _RECORD.pack(_DELETE, len(encoded)) + encoded
+        with self._write_lock():
+            segment = self._current()
+            self._repair(segment)
+            header = segment.read_header()
+            row, _ = segment.lookup(encoded, header.count)
+            if row is None or not segment.alive[row]:
+                return
+            if header.meta_used + len(record) > header.meta_capacity:
+                # Rows keep their numbers when the segment grows
+                segment = self._grow(segment, 0, len(record), header.dim)
+                header = segment.read_header()
+
+            segment.update(generation=header.generation + 1)
+            start = segment.meta_offset + header.meta_used
+            segment.map[start : start + len(record)] = record
+            segment.alive[row] = 0
+            segment.norms[row] = 0.0
+            segment.update(
+                meta_used=header.meta_used + len(record),
+                live=header.live - 1,
+                generation=header.generation + 2,
+            )
+
+    # Queries
+
+    def retrieve_from_key(self, key: str) -> np.array:
+        found = self._live_row(key)
+        if found is None:
+            return None
+        segment, row = found
+        return np.array(segment.vectors[row])
+
+    def search(
+        self,
+        query_vector: np.array,
+        k: int,
+        distance_measure: Callable = cosine_similarity,
+        keys: Iterable[str] = None,
+    ) -> List[Tuple[str, float]]:
+        """
+        Searches the shared index; `keys` optionally restricts the candidates.
+        """
+        encoded_keys = None if keys is None else [key.encode("utf-8") for key in keys]
+
+        def snapshot(segment, header):
+            if encoded_keys is None:
+                return segment, header.count, None
+            rows = []
+            for encoded in encoded_keys:
+                row, _ = segment.lookup(encoded, header.count)
+                if row is not None and segment.alive[row]:
+                    rows.append(row)
+            return segment, header.count, np.array(rows, dtype=np.int64)
+
+        # Published rows never change, so scoring happens outside the seqlock
+        segment, count, rows = self._read(snapshot)
+        if rows is None:
+            # Slice views score the shared pages in place; fancy indexing
+            # would copy the whole matrix into this process
+            vectors, norms, row_ids = segment.vectors[:count], np.array(segment.norms[:count]), None
+        else:
+            vectors, norms, row_ids = segment.vectors[rows], segment.norms[rows], rows
+        if len(norms) == 0:
+            return []
+        row_of = (lambda i: int(i)) if row_ids is None else (lambda i: int(row_ids[i]))
+
+        if distance_measure is not cosine_similarity:
+            scores = [
+                (segment.key_at(row_of(i)), distance_measure(query_vector, vectors[i]))
+                for i in range(len(norms))
+                if segment.alive[row_of(i)]
+            ]
+            return sorted(scores, key=lambda x: x[1], reverse=True)[:k]
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = (vectors @ query) / (norms * np.linalg.norm(query))
+        scores[norms == 0] = -np.inf
+        k = min(k, int(np.count_nonzero(norms)))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(segment.key_at(row_of(i)), float(scores[i])) for i in top]
+
+    async def abuild_from_list(self, list_of_text: List[str]) -> "SharedVectorDatabase":
+        embeddings = await self.embedding_model.async_get_embeddings(list_of_text)
+        self.insert_many(zip(list_of_text, embeddings))
+        return self
@@ -1,6 +1,64 @@
 import os
-from typing import List
-import PyPDF2
+from typing import Iterator, List
+
+
+# File types that can be loaded and indexed
+SUPPORTED_EXTENSIONS = {
+    '.pdf': 'PDF Document',
+    '.txt': 'Text File',
+    '.py': 'Python Code',
+    '.js': 'JavaScript Code',
+    '.ts': 'TypeScript Code',
+    '.tsx': 'TypeScript React',
+    '.jsx': 'JavaScript React',
+    '.md': 'Markdown Document',
+    '.json': 'JSON Data',
+    '.csv': 'CSV Data',
+    '.html': 'HTML Document',
+    '.css': 'CSS Stylesheet',
+    '.yml': 'YAML Configuration',
+    '.yaml': 'YAML Configuration'
+}
+
+
+def iter_supported_files(root: str) -> Iterator[str]:
+    """Lazily yields paths of every supported file under root."""
+    for dirpath, _, files in os.walk(root):
+        for file in files:
+            if os.path.splitext(file)[1].lower() in SUPPORTED_EXTENSIONS:
+                yield os.path.join(dirpath, file)
+
+
+def extract_pdf_text(file_path: str) -> str:
+    """Extracts the text of every page of a PDF, one page per line block."""
+    # Imported here so importing text_utils stays cheap for callers that
+    # never touch a PDF (e.g. serverless cold starts)
+    import PyPDF2
+
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        text = ""
+        for page in pdf_reader.pages:
+            text += page.extract_text() + "\n"
+        return text
+
+
+def read_text_file(file_path: str, encodings=('utf-8', 'latin-1')) -> str:
+    """Reads a text file, trying each encoding in turn."""
+    for encoding in encodings:
+        try:
+            with open(file_path, 'r', encoding=encoding) as f:
+                return f.read()
+        except UnicodeDecodeError:
+            continue
+    raise ValueError(f"Could not decode file {file_path} with any supported encoding")
+
+
+def read_document(file_path: str) -> str:
+    """Reads any supported file into a single text document."""
+    if file_path.lower().endswith('.pdf'):
+        return extract_pdf_text(file_path)
+    return read_text_file(file_path)
 
 
 class TextFileLoader:
@@ -90,31 +148,13 @@ class PDFLoader:
             raise ValueError(f"Error processing file at '{self.path}': {str(e)}")
 
     def load_file(self):
-        with open(self.path, 'rb') as file:
-            # Create PDF reader object
-            pdf_reader = PyPDF2.PdfReader(file)
-            
-            # Extract text from each page
-            text = ""
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
-            
-            self.documents.append(text)
+        self.documents.append(extract_pdf_text(self.path))
 
     def load_directory(self):
         for root, _, files in os.walk(self.path):
             for file in files:
                 if file.lower().endswith('.pdf'):
-                    file_path = os.path.join(root, file)
-                    with open(file_path, 'rb') as f:
-                        pdf_reader = PyPDF2.PdfReader(f)
-                        
-                        # Extract text from each page
-                        text = ""
-                        for page in pdf_reader.pages:
-                            text += page.extract_text() + "\n"
-                        
-                        self.documents.append(text)
+                    self.documents.append(extract_pdf_text(os.path.join(root, file)))
 
     def load_documents(self):
         self.load()
@@ -1,6 +1,9 @@
 import numpy as np
+import json
+import os
+import re
 from collections import defaultdict
-from typing import List, Tuple, Callable
+from typing import Callable, Dict, Iterable, List, Tuple
 from aimakerspace.openai_utils.embedding import EmbeddingModel
 import asyncio
 
@@ -13,6 +16,85 @@ def cosine_similarity(vector_a: np.array, vector_b: np.array) -> float:
     return dot_product / (norm_a * norm_b)
 
 
+INDEX_FILE = "index.npz"
+SEGMENTS_DIR = "segments"
+
+# Keys built by the API and the ingestion CLI look like "[source] chunk text".
+# The source ends at the first "] ", so names such as "report[1].pdf" work.
+_SOURCE_PREFIX = re.compile(r"^\[(.*?)\] ", re.DOTALL)
+
+
+def key_source(key: str) -> str:
+    """Returns the source (file) a "[source] chunk" key belongs to, or ""."""
+    match = _SOURCE_PREFIX.match(key)
+    return match.group(1) if match else ""
+
+
+def write_index_file(file_path: str, keys: List[str], matrix: np.ndarray,
+                     deleted_sources: List[str] = (), sources: List[str] = None) -> None:
+    """
+    Atomically writes keys, their vectors and optional source tombstones to one .npz file.
+
+    `sources` gives the source of each key; without it, sources are parsed
+    from the keys when the file is read.
+    """
+    # Keys are stored as UTF-8 JSON bytes so the file loads without pickle
+    encode = lambda value: np.frombuffer(json.dumps(value).encode("utf-8"), dtype=np.uint8)
+    with open(file_path + ".tmp", "wb") as f:
+        np.savez(
+            f,
+            vectors=matrix,
+            keys=encode(list(keys)),
+            deleted_sources=encode(list(deleted_sources)),
+            **({} if sources is None else {"sources": encode(list(sources))}),
+        )
+    os.replace(file_path + ".tmp", file_path)
+
+
+def read_index_file(file_path: str) -> Tuple[List[str], np.ndarray, List[str], List[str]]:
+    """Reads a file written by `write_index_file`: (keys, vectors, deleted_sources, sources)."""
+    with np.load(file_path) as data:
+        decode = lambda name: json.loads(data[name].tobytes().decode("utf-8"))
+        keys = decode("keys")
+        sources = decode("sources") if "sources" in data.files else [key_source(k) for k in keys]
+        return keys, data["vectors"], decode("deleted_sources"), sources
+
+
+def replay_index(path: str) -> Tuple[Dict[str, np.ndarray], Dict[str, str]]:
+    """
+    Replays `path`/index.npz and then the segments in `path`/segments.
+
+    Segments are applied in order: each first drops every key of its
+    deleted sources, then adds its own keys. Returns the vector and the
+    source of every key left.
+    """
+    files = []
+    if os.path.exists(os.path.join(path, INDEX_FILE)):
+        files.append(os.path.join(path, INDEX_FILE))
+    segments_dir = os.path.join(path, SEGMENTS_DIR)
+    if os.path.isdir(segments_dir):
+        files.extend(
+            os.path.join(segments_dir, name)
+            for name in sorted(os.listdir(segments_dir))
+            if name.endswith(".npz")
+        )
+
+    vectors: Dict[str, np.ndarray] = {}
+    sources: Dict[str, str] = {}
+    keys_by_source = defaultdict(list)
+    for file_path in files:
+        keys, matrix, deleted_sources, key_sources = read_index_file(file_path)
+        for source in deleted_sources:
+            for key in keys_by_source.pop(source, ()):
+                vectors.pop(key, None)
+                sources.pop(key, None)
+        for key, vector, source in zip(keys, matrix, key_sources):
+            vectors[key] = vector
+            sources[key] = source
+            keys_by_source[source].append(key)
+    return vectors, sources
+
+
 class VectorDatabase:
     def __init__(self, embedding_model: EmbeddingModel = None):
         self.vectors = defaultdict(np.array)
@@ -21,6 +103,11 @@ class VectorDatabase:
     def insert(self, key: str, vector: np.array) -> None:
         self.vectors[key] = vector
 
+    def insert_many(self, items: Iterable[Tuple[str, np.array]]) -> None:
+        """Inserts (key, vector) pairs; subclasses may write them in one go."""
+        for key, vector in items:
+            self.insert(key, vector)
+
     def search(
         self,
         query_vector: np.array,
@@ -47,6 +134,43 @@ class VectorDatabase:
     def retrieve_from_key(self, key: str) -> np.array:
         return self.vectors.get(key, None)
 
+    def delete(self, key: str) -> None:
+        self.vectors.pop(key, None)
+
+    def save(self, path: str) -> None:
+        """
+        Persists keys and vectors to `path`/index.npz.
+
+        Keys and vectors share one file, written to a temporary and swapped
+        in with a single rename, so a crash mid-save leaves the previous
+        index intact and keys can never be paired with the wrong rows.
+        """
+        os.makedirs(path, exist_ok=True)
+        keys = list(self.vectors.keys())
+        matrix = (
+            np.stack([np.asarray(self.vectors[key], dtype=np.float32) for key in keys])
+            if keys
+            else np.zeros((0, 0), dtype=np.float32)
+        )
+        write_index_file(os.path.join(path, INDEX_FILE), keys, matrix)
+
+    @classmethod
+    def load(cls, path: str, embedding_model: EmbeddingModel = None, **kwargs) -> "VectorDatabase":
+        """
+        Loads a VectorDatabase previously written with `save`.
+
+        Extra keyword arguments are passed on to the constructor, so
+        subclasses can be loaded with their own options.
+
+        Append-only segments written by the ingestion CLI (`path`/segments)
+        are replayed on top, as described in `replay_index`.
+        """
+        vector_db = cls(embedding_model, **kwargs)
+        vectors, _ = replay_index(path)
+        for key, vector in vectors.items():
+            vector_db.insert(key, vector)
+        return vector_db
+
     async def abuild_from_list(self, list_of_text: List[str]) -> "VectorDatabase":
         embeddings = await self.embedding_model.async_get_embeddings(list_of_text)
         for text, embedding in zip(list_of_text, embeddings):
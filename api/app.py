@@ -1,43 +1,169 @@
+# Record when the module started importing, for the startup report
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 # Import required FastAPI components for building the API
-from fastapi import FastAPI, HTTPException, File, UploadFile, Request
+from fastapi import FastAPI, HTTPException, File, UploadFile, Request, Response
 from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from openai import OpenAI
+import asyncio
+import importlib
 import os
 import tempfile
+import uuid
+from collections import OrderedDict
 from typing import Optional, List
-from dotenv import load_dotenv
 from datetime import datetime
-import numpy as np
 
 import sys
-sys.path.append('../')
-from aimakerspace.text_utils import CharacterTextSplitter
-from aimakerspace.vectordatabase import VectorDatabase
+# Make the repository root importable whatever the working directory is
+_REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+if _REPO_ROOT not in sys.path:
+    sys.path.append(_REPO_ROOT)
+# These modules are lightweight (no numpy, OpenAI or PyPDF2); the RAG stack
+# is imported lazily through _lazy_import on first use
+from aimakerspace.text_utils import CharacterTextSplitter, SUPPORTED_EXTENSIONS
+from aimakerspace.openai_utils.scheduler import BULK, INTERACTIVE, get_scheduler
+from aimakerspace.jobs import Job, JobQueue, JobQueueFull
+
+# Modules that must not be loaded just to serve /api/health or cmd: replies
+HEAVY_MODULES = (
+    'numpy',
+    'openai',
+    'PyPDF2',
+    'aimakerspace.vectordatabase',
+    'aimakerspace.shared_vectordatabase',
+    'aimakerspace.openai_utils.chatmodel',
+    'aimakerspace.openai_utils.embedding',
+)
+
+_startup_report = {"app_import_ms": None, "lazy_imports_ms": {}}
+_environment_loaded = False
+
+
+def _load_environment():
+    """Load .env.local once, on the first request that needs OpenAI."""
+    global _environment_loaded
+    if not _environment_loaded:
+        from dotenv import load_dotenv
+        load_dotenv(dotenv_path=os.path.join(_REPO_ROOT, '.env.local'))
+        _environment_loaded = True
+
+
+_shared_vector_db = None
+
+
+def _get_shared_vector_db():
+    """
+    Return this worker's handle on the shared vector index, or None.
+
+    Enabled with VECTOR_INDEX_MODE=shared; all uvicorn workers then map the
+    same segment (VECTOR_INDEX_SHARED_PATH, default under /dev/shm) instead
+    of each holding its own copy of the vectors.
+    """
+    global _shared_vector_db
+    if os.getenv("VECTOR_INDEX_MODE", "").lower() != "shared":
+        return None
+    if _shared_vector_db is None:
+        embedding = _lazy_import("aimakerspace.openai_utils.embedding")
+        shared = _lazy_import("aimakerspace.shared_vectordatabase")
+        _shared_vector_db = shared.SharedVectorDatabase(
+            embedding_model=embedding.EmbeddingModel(priority=INTERACTIVE)
+        )
+    return _shared_vector_db
+
+
+_local_vector_index = None
+# Files in this worker's local index with their chunk keys, oldest first.
+# The index is bounded: once it holds more than LOCAL_INDEX_MAX_CHUNKS
+# chunks, the files indexed longest ago are dropped (chat re-embeds any
+# chunk it no longer finds).
+LOCAL_INDEX_MAX_CHUNKS = int(os.getenv("LOCAL_INDEX_MAX_CHUNKS", "20000"))
+_local_index_files = OrderedDict()
+_local_index_size = 0
+
+
+def _track_local_chunks(filename: str, keys: List[str]):
+    """Record chunks inserted into the local index, evicting old files past the bound."""
+    global _local_index_size
+    file_keys = _local_index_files.setdefault(filename, set())
+    _local_index_files.move_to_end(filename)
+    _local_index_size -= len(file_keys)
+    file_keys.update(keys)
+    _local_index_size += len(file_keys)
+    while _local_index_size > LOCAL_INDEX_MAX_CHUNKS and len(_local_index_files) > 1:
+        oldest = next(iter(_local_index_files))
+        _forget_local_file(oldest)
+
 
-load_dotenv(dotenv_path="../.env.local")
+def _forget_local_file(filename: str):
+    """Drop a file's chunks from this worker's local index, if it holds any."""
+    global _local_index_size
+    keys = _local_index_files.pop(filename, ())
+    _local_index_size -= len(keys)
+    for key in keys:
+        _local_vector_index.delete(key)
+
+
+def _get_vector_index():
+    """
+    Return the index that background ingestion writes into.
+
+    This is the shared index in VECTOR_INDEX_MODE=shared, otherwise a
+    bounded VectorDatabase local to this worker process. Chat requests
+    reuse the embeddings stored there instead of embedding those chunks
+    again.
+    """
+    global _local_vector_index
+    shared_vector_db = _get_shared_vector_db()
+    if shared_vector_db is not None:
+        return shared_vector_db
+    if _local_vector_index is None:
+        embedding = _lazy_import("aimakerspace.openai_utils.embedding")
+        vectordatabase = _lazy_import("aimakerspace.vectordatabase")
+        _local_vector_index = vectordatabase.VectorDatabase(
+            embedding.EmbeddingModel(priority=INTERACTIVE)
+        )
+    return _local_vector_index
+
+
+def _lazy_import(module_name: str):
+    """Import a heavy module on first use, recording how long it took."""
+    module = sys.modules.get(module_name)
+    if module is None:
+        _load_environment()
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        _startup_report["lazy_imports_ms"][module_name] = round(
+            (time.perf_counter() - started) * 1000, 2
+        )
+    return module
 
 # Initialize FastAPI application with a title
 app = FastAPI(title="OpenAI Chat API with Multi-File RAG")
 
-# Supported file types
-SUPPORTED_EXTENSIONS = {
-    '.pdf': 'PDF Document',
-    '.txt': 'Text File',
-    '.py': 'Python Code',
-    '.js': 'JavaScript Code',
-    '.ts': 'TypeScript Code',
-    '.tsx': 'TypeScript React',
-    '.jsx': 'JavaScript React',
-    '.md': 'Markdown Document',
-    '.json': 'JSON Data',
-    '.csv': 'CSV Data',
-    '.html': 'HTML Document',
-    '.css': 'CSS Stylesheet',
-    '.yml': 'YAML Configuration',
-    '.yaml': 'YAML Configuration'
-}
+# Uploads are indexed by a bounded pool of background workers, so large
+# files never hold an HTTP request (or chat traffic) hostage. Job state is
+# kept in INGEST_JOB_DIR so that every uvicorn worker can report on it.
+ingestion_jobs = JobQueue(
+    workers=int(os.getenv("INGEST_WORKERS", "2")),
+    max_pending=int(os.getenv("INGEST_MAX_PENDING", "100")),
+    state_dir=os.getenv("INGEST_JOB_DIR") or os.path.join(tempfile.gettempdir(), "aimakerspace-jobs"),
+    finished_ttl=float(os.getenv("INGEST_JOB_TTL", "3600")),
+)
+
+
+def _ingest_in_background() -> bool:
+    """
+    Whether uploads are indexed by background jobs (INGEST_MODE=background)
+    or within the upload request (INGEST_MODE=sync).
+
+    Serverless platforms freeze the process once a response is sent, so
+    background work never finishes there; on Vercel the default is sync.
+    """
+    default = "sync" if os.getenv("VERCEL") else "background"
+    return os.getenv("INGEST_MODE", default).lower() != "sync"
 
 # Configure CORS
 app.add_middleware(
@@ -50,11 +176,13 @@ app.add_middleware(
 
 class UniversalFileLoader:
     """Universal file loader that can handle multiple file types"""
-    def __init__(self, file_path: str, filename: str):
+    def __init__(self, file_path: str, filename: str, on_progress=None):
         self.documents = []
         self.file_path = file_path
         self.filename = filename
         self.file_ext = os.path.splitext(filename)[1].lower()
+        # Optional callback(pages_parsed, pages_total) for progress reporting
+        self.on_progress = on_progress or (lambda parsed, total: None)
     
     def load(self):
         """Load file based on its extension"""
@@ -71,9 +199,11 @@ class UniversalFileLoader:
         import PyPDF2
         with open(self.file_path, 'rb') as file:
             pdf_reader = PyPDF2.PdfReader(file)
+            pages_total = len(pdf_reader.pages)
             text = ""
-            for page in pdf_reader.pages:
+            for pages_parsed, page in enumerate(pdf_reader.pages, start=1):
                 text += page.extract_text() + "\n"
+                self.on_progress(pages_parsed, pages_total)
             self.documents.append(text)
         return self.documents
     
@@ -86,6 +216,7 @@ class UniversalFileLoader:
                 with open(self.file_path, 'r', encoding=encoding) as file:
                     content = file.read()
                     self.documents.append(content)
+                    self.on_progress(1, 1)
                     return self.documents
             except UnicodeDecodeError:
                 continue
@@ -214,6 +345,9 @@ For regular conversation, just type your message without the cmd: prefix."""
                         break
                 
                 if file_to_remove:
+                    # Stop holding its vectors in this worker's local index
+                    _forget_local_file(file_to_remove.filename)
+
                     # Return the updated file list (frontend will handle the removal)
                     updated_files = [f for f in chat_request.uploaded_files if f.filename != file_to_remove.filename]
                     
@@ -246,14 +380,26 @@ For regular conversation, just type your message without the cmd: prefix."""
                     "streaming": False
                 }
         
-        # Initialize OpenAI client
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # Chat completions go through the shared upstream scheduler with
+        # interactive priority, ahead of any bulk ingestion work
+        chatmodel = _lazy_import("aimakerspace.openai_utils.chatmodel")
+        chat_model = chatmodel.ChatOpenAI(model_name=chat_request.model, priority=INTERACTIVE)
         
         # If we have uploaded files, rebuild vector database and use RAG
         if chat_request.uploaded_files:
             try:
-                # Rebuild vector database from processed chunks
-                vector_db = VectorDatabase()
+                # Rebuild vector database from processed chunks; these
+                # embeddings are on the chat path, so they are interactive too
+                np = _lazy_import("numpy")
+                shared_vector_db = _get_shared_vector_db()
+                if shared_vector_db is None:
+                    embedding = _lazy_import("aimakerspace.openai_utils.embedding")
+                    vectordatabase = _lazy_import("aimakerspace.vectordatabase")
+                    vector_db = vectordatabase.VectorDatabase(
+                        embedding.EmbeddingModel(priority=INTERACTIVE)
+                    )
+                else:
+                    vector_db = shared_vector_db
                 
                 # Collect all chunks from all files
                 all_chunks = []
@@ -262,17 +408,41 @@ For regular conversation, just type your message without the cmd: prefix."""
                         all_chunks.append(f"[{chunk.filename}] {chunk.text}")
                 
                 if all_chunks:
-                    # Build vector database from chunks
-                    vector_db = await vector_db.abuild_from_list(all_chunks)
+                    if shared_vector_db is None:
+                        # Reuse vectors the background ingestion already
+                        # stored; build the rest of the database from chunks
+                        vector_index = _get_vector_index()
+                        missing_chunks = []
+                        for chunk_key in all_chunks:
+                            vector = vector_index.retrieve_from_key(chunk_key)
+                            if vector is None:
+                                missing_chunks.append(chunk_key)
+                            else:
+                                vector_db.insert(chunk_key, vector)
+                        if missing_chunks:
+                            vector_db = await vector_db.abuild_from_list(missing_chunks)
+                        search_keys = {}
+                    else:
+                        # The shared index already holds chunks embedded by
+                        # any worker; only embed the ones it has not seen, and
+                        # search within this conversation's files only
+                        missing_chunks = [c for c in all_chunks if c not in vector_db.vectors]
+                        if missing_chunks:
+                            await vector_db.abuild_from_list(missing_chunks)
+                        search_keys = {"keys": all_chunks}
                     
                     # RAG-enhanced chat
                     async def generate_rag():
-                        # Get relevant context from vector database
-                        relevant_chunks = vector_db.search_by_text(
-                            chat_request.user_message, 
-                            k=3, 
-                            return_as_text=True
+                        # Get relevant context from vector database, embedding
+                        # the query without blocking the event loop
+                        query_vector = await vector_db.embedding_model.async_get_embedding(
+                            chat_request.user_message
                         )
+                        relevant_chunks = [
+                            key for key, _ in vector_db.search(
+                                np.array(query_vector), k=3, **search_keys
+                            )
+                        ]
                         
                         # Create context from relevant chunks
                         context = "\n\n".join(relevant_chunks) if relevant_chunks else ""
@@ -293,18 +463,11 @@ DOCUMENT CONTENT:
 Please answer the user's question based on the document content above. If the question cannot be answered from the documents, say so clearly."""
 
                         # Create streaming response with RAG context
-                        stream = client.chat.completions.create(
-                            model=chat_request.model,
-                            messages=[
-                                {"role": "developer", "content": enhanced_developer_message},
-                                {"role": "user", "content": chat_request.user_message}
-                            ],
-                            stream=True
-                        )
-                        
-                        for chunk in stream:
-                            if chunk.choices[0].delta.content is not None:
-                                yield chunk.choices[0].delta.content
+                        async for content in chat_model.astream([
+                            {"role": "developer", "content": enhanced_developer_message},
+                            {"role": "user", "content": chat_request.user_message}
+                        ]):
+                            yield content
 
                     return StreamingResponse(generate_rag(), media_type="text/plain")
             
@@ -324,18 +487,11 @@ Falling back to regular chat without file context."""
         
         # Regular chat without RAG
         async def generate():
-            stream = client.chat.completions.create(
-                model=chat_request.model,
-                messages=[
-                    {"role": "developer", "content": chat_request.developer_message},
-                    {"role": "user", "content": chat_request.user_message}
-                ],
-                stream=True
-            )
-            
-            for chunk in stream:
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
+            async for content in chat_model.astream([
+                {"role": "developer", "content": chat_request.developer_message},
+                {"role": "user", "content": chat_request.user_message}
+            ]):
+                yield content
 
         return StreamingResponse(generate(), media_type="text/plain")
     
@@ -347,9 +503,90 @@ Falling back to regular chat without file context."""
 async def health_check():
     return {"status": "ok"}
 
-# Define the file upload and indexing endpoint
-@app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...)):
+# Expose upstream concurrency, budget, queue depth and wait-time statistics
+@app.get("/api/scheduler")
+async def scheduler_stats():
+    return get_scheduler().stats()
+
+# Report how long the app took to import and what was loaded lazily since
+@app.get("/api/startup")
+async def startup_report():
+    return {
+        **_startup_report,
+        "heavy_modules_loaded": [name for name in HEAVY_MODULES if name in sys.modules],
+    }
+
+# Embedding batch size for background ingestion; each batch is stored in
+# the index as soon as it lands, for chat to reuse once the job completes
+INGEST_BATCH_SIZE = 64
+
+
+async def _ingest_upload(job, temp_file_path: str, filename: str, file_size: int,
+                         embed: bool = True):
+    """
+    Background job: load -> split -> embed -> index one uploaded file.
+
+    With embed=False the file is only loaded and split; chat embeds the
+    chunks when they are first used.
+    """
+    file_ext = os.path.splitext(filename)[1].lower()
+    try:
+        job.update(pages_parsed=0, pages_total=None, chunks_total=None, chunks_embedded=0)
+
+        # Parsing and splitting are blocking, so keep them off the event loop
+        def on_progress(pages_parsed, pages_total):
+            job.update(pages_parsed=pages_parsed, pages_total=pages_total)
+
+        file_loader = UniversalFileLoader(temp_file_path, filename, on_progress)
+        documents = await asyncio.to_thread(file_loader.load)
+        if not documents:
+            raise ValueError("Could not extract text from file.")
+
+        text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
+        chunks = await asyncio.to_thread(text_splitter.split_texts, documents)
+        if not chunks:
+            raise ValueError("No text chunks created from file.")
+        job.update(chunks_total=len(chunks))
+
+        if embed:
+            # Embed with bulk priority so interactive chat always goes first
+            np = _lazy_import("numpy")
+            vector_index = _get_vector_index()
+            embedding = _lazy_import("aimakerspace.openai_utils.embedding")
+            embedding_model = embedding.EmbeddingModel(priority=BULK)
+            keys = [f"[{filename}] {chunk}" for chunk in chunks]
+            for start in range(0, len(keys), INGEST_BATCH_SIZE):
+                batch = keys[start : start + INGEST_BATCH_SIZE]
+                embeddings = await embedding_model.async_get_embeddings(batch)
+                vector_index.insert_many(zip(batch, map(np.array, embeddings)))
+                if vector_index is _local_vector_index:
+                    _track_local_chunks(filename, batch)
+                job.update(chunks_embedded=start + len(batch))
+
+        file_info = FileInfo(
+            filename=filename,
+            file_type=SUPPORTED_EXTENSIONS[file_ext],
+            uploaded_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            chunks_count=len(chunks),
+            file_size=file_size,
+            processed_chunks=[ProcessedChunk(text=chunk, filename=filename) for chunk in chunks]
+        )
+        return {
+            "success": True,
+            "message": f"File '{filename}' ({SUPPORTED_EXTENSIONS[file_ext]}) uploaded and indexed successfully! You can now ask questions about it.",
+            "file_info": file_info.dict(),
+            "chunks_created": len(chunks)
+        }
+    finally:
+        # Clean up temporary file
+        if os.path.exists(temp_file_path):
+            os.unlink(temp_file_path)
+
+
+# Define the file upload endpoint; indexing runs as a background job
+# unless INGEST_MODE=sync
+@app.post("/api/upload", status_code=202)
+async def upload_file(response: Response, file: UploadFile = File(...)):
     try:
         # Validate file type
         if not file.filename:
@@ -366,63 +603,67 @@ async def upload_file(file: UploadFile = File(...)):
         # Read the uploaded file
         file_content = await file.read()
         
-        # Save to temporary file for processing
+        # Save to temporary file for the background job to process
         with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as temp_file:
             temp_file.write(file_content)
             temp_file_path = temp_file.name
         
-        try:
-            # Load and process the file using UniversalFileLoader
-            file_loader = UniversalFileLoader(temp_file_path, file.filename)
-            documents = file_loader.load()
-            
-            if not documents:
-                raise HTTPException(status_code=400, detail="Could not extract text from file.")
-            
-            # Split text into chunks
-            text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=200)
-            chunks = text_splitter.split_texts(documents)
-            
-            if not chunks:
-                raise HTTPException(status_code=400, detail="No text chunks created from file.")
-            
-            # Create processed chunks
-            processed_chunks = []
-            for chunk in chunks:
-                processed_chunks.append(ProcessedChunk(
-                    text=chunk,
-                    filename=file.filename
-                ))
-            
-            # Create file info with all processed data
-            file_info = FileInfo(
-                filename=file.filename,
-                file_type=SUPPORTED_EXTENSIONS[file_ext],
-                uploaded_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                chunks_count=len(chunks),
-                file_size=len(file_content),
-                processed_chunks=processed_chunks
+        if not _ingest_in_background():
+            # Process within this request and return the finished job. A
+            # worker's own index does not outlive a serverless invocation,
+            # so chunks are only embedded here into the shared index;
+            # otherwise chat embeds them when they are first used.
+            job = Job(uuid.uuid4().hex, "ingest")
+            job.result = await _ingest_upload(
+                job, temp_file_path, file.filename, len(file_content),
+                embed=_get_shared_vector_db() is not None,
             )
-            
+            job.status = "completed"
+            response.status_code = 200
             return {
                 "success": True,
-                "message": f"File '{file.filename}' ({SUPPORTED_EXTENSIONS[file_ext]}) uploaded and indexed successfully! You can now ask questions about it.",
-                "file_info": file_info.dict(),
-                "chunks_created": len(chunks)
+                "job_id": job.id,
+                "status": job.status,
+                "result": job.result,
             }
-            
-        finally:
-            # Clean up temporary file
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
+
+        try:
+            job = ingestion_jobs.submit(
+                "ingest", _ingest_upload, temp_file_path, file.filename, len(file_content)
+            )
+        except JobQueueFull as e:
+            os.unlink(temp_file_path)
+            raise HTTPException(status_code=503, detail=str(e))
+        
+        return {
+            "success": True,
+            "job_id": job.id,
+            "status": job.status,
+            "message": f"File '{file.filename}' queued for indexing."
+        }
     
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
+# Report progress of a background ingestion job
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = ingestion_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job '{job_id}' not found.")
+    return job.to_dict()
+
+_startup_report["app_import_ms"] = round((time.perf_counter() - _IMPORT_STARTED) * 1000, 2)
+
+
 # Entry point for running the application directly
 if __name__ == "__main__":
+    if "--check-cold-start" in sys.argv:
+        from cold_start import check_cold_start
+        sys.exit(check_cold_start())
+
     import uvicorn
     # Start the server on all network interfaces (0.0.0.0) on port 8000
     uvicorn.run(app, host="0.0.0.0", port=8000)
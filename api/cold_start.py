@@ -0,0 +1,77 @@
+"""
+Cold-start measurement for the API.
+
+`measure_cold_start` imports app.py in a fresh interpreter and reports how
+long the import took and which of app.HEAVY_MODULES it loaded. It backs
+both `python app.py --check-cold-start` and api/tests/test_cold_start.py.
+"""
+
+import json
+import os
+import subprocess
+import sys
+from typing import Any, Dict
+
+_API_DIR = os.path.dirname(os.path.abspath(__file__))
+
+_PROBE = (
+    "import json, sys, time\n"
+    "started = time.perf_counter()\n"
+    "import app\n"
+    "elapsed = (time.perf_counter() - started) * 1000\n"
+    "print(json.dumps({'import_ms': round(elapsed, 2), "
+    "'heavy_modules_loaded': [m for m in app.HEAVY_MODULES if m in sys.modules]}))\n"
+)
+
+
+def cold_start_budget_ms() -> float:
+    """The import-time budget: COLD_START_BUDGET_MS, or 1500."""
+    return float(os.getenv("COLD_START_BUDGET_MS", "1500"))
+
+
+def measure_cold_start() -> Dict[str, Any]:
+    """
+    Import the app in a fresh interpreter.
+
+    Returns {"import_ms": float, "heavy_modules_loaded": [module names]}.
+
+    :raises RuntimeError: if the app fails to import
+    """
+    result = subprocess.run(
+        [sys.executable, "-c", _PROBE],
+        cwd=_API_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing app.py failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def check_cold_start(budget_ms: float = None) -> int:
+    """
+    Print the cold-start measurement against the budget.
+
+    Returns a process exit code so it can gate CI.
+    """
+    if budget_ms is None:
+        budget_ms = cold_start_budget_ms()
+    try:
+        report = measure_cold_start()
+    except RuntimeError as e:
+        print(e)
+        return 1
+
+    print(f"Cold import: {report['import_ms']}ms (budget {budget_ms}ms)")
+    if report["heavy_modules_loaded"]:
+        print(f"FAIL: heavy modules loaded at import time: {report['heavy_modules_loaded']}")
+        return 1
+    if report["import_ms"] > budget_ms:
+        print("FAIL: cold import exceeded budget")
+        return 1
+    print("OK")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(check_cold_start())
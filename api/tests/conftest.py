@@ -0,0 +1,9 @@
+import os
+import sys
+
+# Tests import app.py and its helpers from api/, and the aimakerspace
+# package from the repository root
+_API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (_API_DIR, os.path.dirname(_API_DIR)):
+    if path not in sys.path:
+        sys.path.insert(0, path)
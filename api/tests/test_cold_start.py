@@ -0,0 +1,16 @@
+import pytest
+
+# The probe imports the whole app, so it needs the API's dependencies
+pytest.importorskip("fastapi")
+
+from cold_start import cold_start_budget_ms, measure_cold_start
+
+
+def test_app_import_loads_no_heavy_modules():
+    report = measure_cold_start()
+    assert report["heavy_modules_loaded"] == []
+
+
+def test_app_import_within_budget():
+    report = measure_cold_start()
+    assert report["import_ms"] <= cold_start_budget_ms()
@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("openai")
+
+from aimakerspace.sharded_vectordatabase import ShardedVectorDatabase
+from aimakerspace.vectordatabase import VectorDatabase
+
+# Searching by vector needs no embedding model (or API key)
+NO_EMBEDDINGS = object()
+DIM = 32
+
+
+def _random_items(count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [(f"[file{i % 7}.txt] chunk {i}", rng.standard_normal(DIM).astype(np.float32))
+            for i in range(count)]
+
+
+def _assert_same_results(sharded, reference, queries, k=10):
+    for query in queries:
+        expected = reference.search(query, k)
+        actual = sharded.search(query, k)
+        assert [key for key, _ in actual] == [key for key, _ in expected]
+        assert [score for _, score in actual] == pytest.approx([score for _, score in expected], rel=1e-4)
+
+
+@pytest.mark.parametrize("partition", ["hash", "source"])
+def test_search_matches_vector_database(partition):
+    reference = VectorDatabase(NO_EMBEDDINGS)
+    queries = [vector for _, vector in _random_items(5, seed=1)]
+    with ShardedVectorDatabase(NO_EMBEDDINGS, num_shards=4, partition=partition) as sharded:
+        for key, vector in _random_items(500):
+            reference.insert(key, vector)
+            sharded.insert(key, vector)
+        _assert_same_results(sharded, reference, queries)
+
+        # Updates and deletes leave dead rows behind in the shards
+        for key, vector in _random_items(100, seed=2)[:50]:
+            reference.insert(key, vector)
+            sharded.insert(key, vector)
+        for key, _ in _random_items(500)[::3]:
+            reference.delete(key)
+            sharded.delete(key)
+        _assert_same_results(sharded, reference, queries)
+        assert sorted(sharded.vectors) == sorted(reference.vectors)
+
+
+def test_compaction_keeps_results():
+    reference = VectorDatabase(NO_EMBEDDINGS)
+    queries = [vector for _, vector in _random_items(3, seed=1)]
+    with ShardedVectorDatabase(NO_EMBEDDINGS, num_shards=2) as sharded:
+        items = _random_items(5000)
+        for key, vector in items:
+            reference.insert(key, vector)
+            sharded.insert(key, vector)
+        for key, _ in items[:4000]:
+            reference.delete(key)
+            sharded.delete(key)
+        assert all(shard.dead < 1024 for shard in sharded.shards)
+        _assert_same_results(sharded, reference, queries)
+
+
+def test_searches_run_alongside_writes():
+    items = _random_items(2000)
+    errors = []
+    with ShardedVectorDatabase(NO_EMBEDDINGS, num_shards=4) as sharded:
+        for key, vector in items[:1000]:
+            sharded.insert(key, vector)
+
+        def search():
+            try:
+                for _, query in items[:200]:
+                    for key, score in sharded.search(query, 5):
+                        assert key is not None and np.isfinite(score)
+            except Exception as e:
+                errors.append(e)
+
+        searchers = [threading.Thread(target=search) for _ in range(4)]
+        for thread in searchers:
+            thread.start()
+        for key, vector in items[1000:]:
+            sharded.insert(key, vector)
+        for key, _ in items[:500]:
+            sharded.delete(key)
+        for thread in searchers:
+            thread.join()
+    assert errors == []
+
+
+def test_load_keeps_shard_options(tmp_path):
+    with ShardedVectorDatabase(NO_EMBEDDINGS, num_shards=2) as sharded:
+        for key, vector in _random_items(50):
+            sharded.insert(key, vector)
+        sharded.save(str(tmp_path))
+    with ShardedVectorDatabase.load(str(tmp_path), NO_EMBEDDINGS, num_shards=3, partition="source") as loaded:
+        assert len(loaded.shards) == 3
+        assert loaded.partition == "source"
+        assert len(loaded.vectors) == 50
@@ -0,0 +1,141 @@
+import multiprocessing
+import os
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("openai")
+
+from aimakerspace import shared_vectordatabase
+from aimakerspace.shared_vectordatabase import SharedVectorDatabase
+
+# Searching by vector needs no embedding model (or API key)
+NO_EMBEDDINGS = object()
+DIM = 16
+# Writers in separate processes, as with several uvicorn workers
+spawn = multiprocessing.get_context("spawn")
+
+
+def _vector(seed: int) -> np.ndarray:
+    return np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+
+
+def _insert_range(path: str, start: int, stop: int, batch: int = 50) -> None:
+    db = SharedVectorDatabase(path, NO_EMBEDDINGS)
+    for offset in range(start, stop, batch):
+        db.insert_many((f"key {i}", _vector(i)) for i in range(offset, min(offset + batch, stop)))
+
+
+def _die_before_publishing(path: str, items) -> None:
+    """Runs insert_many, exiting abruptly just before it publishes."""
+    db = SharedVectorDatabase(path, NO_EMBEDDINGS)
+    update = shared_vectordatabase._Segment.update
+
+    def dying_update(segment, **fields):
+        if fields.get("generation", 1) % 2 == 0:
+            os._exit(1)
+        update(segment, **fields)
+
+    shared_vectordatabase._Segment.update = dying_update
+    db.insert_many(items)
+
+
+def _run(target, *args) -> int:
+    process = spawn.Process(target=target, args=args)
+    process.start()
+    process.join(60)
+    return process.exitcode
+
+
+def test_concurrent_inserts_and_searches(tmp_path):
+    path = str(tmp_path / "index")
+    # A small segment makes the writers grow it several times
+    reader = SharedVectorDatabase(path, NO_EMBEDDINGS, dim=DIM, initial_capacity=64)
+    writers = [
+        spawn.Process(target=_insert_range, args=(path, 0, 1500)),
+        spawn.Process(target=_insert_range, args=(path, 1500, 3000)),
+    ]
+    for writer in writers:
+        writer.start()
+
+    searches = 0
+    while any(writer.is_alive() for writer in writers) or searches == 0:
+        for key, score in reader.search(_vector(searches % 3000), k=5):
+            assert np.isfinite(score)
+            assert np.array_equal(reader.retrieve_from_key(key), _vector(int(key.split()[1])))
+        searches += 1
+    for writer in writers:
+        writer.join()
+        assert writer.exitcode == 0
+
+    assert len(reader.vectors) == 3000
+    for i in range(0, 3000, 97):
+        (key, score), = reader.search(_vector(i), k=1)
+        assert key == f"key {i}" and score == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize("first_access", ["read", "write"])
+def test_writer_killed_mid_transaction(tmp_path, first_access):
+    path = str(tmp_path / "index")
+    db = SharedVectorDatabase(path, NO_EMBEDDINGS, dim=DIM)
+    db.insert_many([("a", _vector(1)), ("b", _vector(2))])
+
+    # Dies after re-inserting "a" and adding "c", before either is published
+    assert _run(_die_before_publishing, path, [("a", _vector(10)), ("c", _vector(3))]) == 1
+
+    started = time.monotonic()
+    if first_access == "write":
+        db.insert("d", _vector(4))
+    assert np.array_equal(db.retrieve_from_key("a"), _vector(1))
+    assert time.monotonic() - started < 5
+
+    assert "c" not in db.vectors
+    assert sorted(db.vectors) == (["a", "b", "d"] if first_access == "write" else ["a", "b"])
+    # The dead writer had retired a's old row; repair made it live again
+    (key, score), = db.search(_vector(1), k=1)
+    assert key == "a" and score == pytest.approx(1.0)
+
+    db.insert("c", _vector(3))
+    assert np.array_equal(db.retrieve_from_key("c"), _vector(3))
+
+
+def test_grow_while_reader_is_mapped(tmp_path):
+    path = str(tmp_path / "index")
+    reader = SharedVectorDatabase(path, NO_EMBEDDINGS, dim=DIM, initial_capacity=16)
+    reader.insert_many((f"key {i}", _vector(i)) for i in range(10))
+    assert reader.search(_vector(3), k=1)[0][0] == "key 3"
+    old_segment = reader._segment
+    old_vectors = old_segment.vectors
+
+    # Another process grows the segment several times over
+    assert _run(_insert_range, path, 10, 1000) == 0
+
+    # Views taken before the grow still read the old segment's pages
+    assert np.array_equal(old_vectors[3], _vector(3))
+    assert len(reader.vectors) == 1000
+    assert reader._segment is not old_segment
+    assert reader.search(_vector(999), k=1)[0][0] == "key 999"
+    assert np.array_equal(reader.retrieve_from_key("key 3"), _vector(3))
+
+
+def test_reinserted_key_gets_a_new_row(tmp_path):
+    db = SharedVectorDatabase(str(tmp_path / "index"), NO_EMBEDDINGS)
+    db.insert("a", _vector(1))
+    db.insert("a", _vector(2))
+    assert len(db.vectors) == 1
+    assert db._segment.read_header().count == 2
+    assert np.array_equal(db.retrieve_from_key("a"), _vector(2))
+    # Only the new version is scored
+    (key, score), = db.search(_vector(2), k=5)
+    assert key == "a" and score == pytest.approx(1.0)
+
+
+def test_dimension_comes_from_first_insert(tmp_path):
+    path = str(tmp_path / "index")
+    db = SharedVectorDatabase(path, NO_EMBEDDINGS)
+    db.insert("a", np.ones(8))
+    with pytest.raises(ValueError, match="8-dimensional"):
+        db.insert("b", np.ones(4))
+    with pytest.raises(ValueError, match="8-dimensional"):
+        SharedVectorDatabase(path, NO_EMBEDDINGS, dim=4)
@@ -313,6 +313,40 @@ export default function TerminalBox() {
     }
   };
 
+  // An indexing job whose status and progress have not changed for this
+  // long is reported as failed instead of being polled forever
+  const JOB_STALL_TIMEOUT_MS = 5 * 60 * 1000;
+
+  const waitForJob = async (jobId: string): Promise<any> => {
+    let lastState = '';
+    let lastChangeAt = Date.now();
+    while (true) {
+      const response = await fetch(`/api/jobs/${jobId}`);
+      if (!response.ok) {
+        const errorData = await response.json().catch(() => ({ detail: 'Job status unavailable' }));
+        throw new Error(errorData.detail || `Job status failed: ${response.statusText}`);
+      }
+
+      const job = await response.json();
+      if (job.status === 'completed') {
+        return job.result;
+      }
+      if (job.status === 'failed') {
+        throw new Error(job.error || 'Indexing failed');
+      }
+
+      const state = JSON.stringify([job.status, job.progress]);
+      if (state !== lastState) {
+        lastState = state;
+        lastChangeAt = Date.now();
+      } else if (Date.now() - lastChangeAt > JOB_STALL_TIMEOUT_MS) {
+        throw new Error('Indexing failed: the job made no progress for 5 minutes');
+      }
+
+      await new Promise(resolve => setTimeout(resolve, 1000));
+    }
+  };
+
   const uploadFile = async (file: File): Promise<string> => {
     console.log('Uploading file:', file.name);
     
@@ -332,7 +366,14 @@ export default function TerminalBox() {
         throw new Error(errorData.detail || `Upload failed: ${response.statusText}`);
       }
 
-      const result = await response.json();
+      const job = await response.json();
+      if (!job.success || !job.job_id) {
+        throw new Error(job.message || 'Upload failed');
+      }
+
+      // Indexing runs as a background job; poll until it finishes.
+      // Servers in sync ingest mode return the finished job directly.
+      const result = job.status === 'completed' ? job.result : await waitForJob(job.job_id);
       if (result.success && result.file_info) {
         // Check if file already exists
         const existingFileIndex = uploadedFiles.findIndex(f => f.filename === result.file_info.filename);